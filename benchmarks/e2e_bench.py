@@ -0,0 +1,189 @@
+import sys
+import os
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import logging
+import string
+import threading
+import time
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+
+# Add the repository root and this directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+import maps_stub
+import gemini_stub
+
+# End to end latency of the Flask app against the local Maps and Gemini stand-ins:
+#   python benchmarks/e2e_bench.py --requests 40 --concurrency 8 --maps-latency 0.1 --gemini-latency 1.5
+# Without --mongo the app runs on mongomock, an in-memory fake. Every endpoint first gets a cold
+# pass (new cities, so every cache misses) and then a warm pass replaying the same requests.
+
+ENDPOINTS = ('prompt', 'apply_filters', 'maps/restaurants', 'maps/tourist', 'maps/transit', 'maps/route/drive', 'maps/route/transit', 'maps/route/legs')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+class Server(object):
+  # Serves a WSGI app on a free local port from a background thread
+  def __init__(self, app):
+    self.server = make_server('127.0.0.1', 0, app, threaded=True)
+    self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+
+  def close(self):
+    self.server.shutdown()
+
+def city_name(i, run, endpoint=0):
+  # Letters only, the Gemini stand-in reads the city as a capitalised word. Every endpoint gets
+  # its own cities, otherwise the searches of one endpoint warm the cold pass of the next.
+  letters = ''
+  for value in (run, endpoint, i):
+    while True:
+      value, rest = divmod(value, 26)
+      letters += string.ascii_lowercase[rest]
+      if value == 0:
+        break
+    letters += 'x'
+  return 'Bench' + letters
+
+def request_body(endpoint, city):
+  if endpoint == 'prompt':
+    return {'prompt': 'Plan a 2 day trip to {} with friends, we like museums and italian food.'.format(city)}
+  if endpoint == 'apply_filters':
+    return {'location': city, 'cuisine': 'italian', 'duration': 2, 'timings': '09:00-20:00'}
+  if endpoint in ('maps/restaurants', 'maps/tourist', 'maps/transit'):
+    return {'city': city, 'category': 'italian'}
+  if endpoint == 'maps/route/legs':
+    stops = ('station', 'museum', 'park', 'market', 'station')
+    return {'places': [{'address': '{} {}'.format(city, stop)} for stop in stops], 'travelMode': 'DRIVE', 'routingPreference': 'TRAFFIC_AWARE'}
+  if endpoint == 'maps/route/drive':
+    return {'origin': {'address': city + ' station'}, 'destination': {'address': city + ' museum'}, 'travelMode': 'DRIVE'}
+  return {'origin': {'address': city + ' station'}, 'destination': {'address': city + ' museum'}}
+
+def drive(url, endpoint, bodies, concurrency):
+  # Sends every body to the endpoint with concurrency clients, returns latencies and errors
+  session = requests.Session()
+  adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+  session.mount('http://', adapter)
+
+  def send(body):
+    tic = time.perf_counter()
+    try:
+      response = session.post('{}/{}'.format(url, endpoint), json=body, timeout=120)
+      ok = response.status_code < 400 and 'error' not in response.text[:200]
+    except requests.RequestException:
+      ok = False
+    return time.perf_counter() - tic, ok
+
+  tic = time.perf_counter()
+  with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+    outcomes = list(executor.map(send, bodies))
+  elapsed = time.perf_counter() - tic
+  latencies = np.array([seconds for seconds, _ in outcomes])
+  return {
+    'requests': len(outcomes),
+    'errors': sum(1 for _, ok in outcomes if not ok),
+    'seconds': round(elapsed, 3),
+    'throughput_rps': round(len(outcomes) / elapsed, 2) if elapsed else None,
+    'mean_ms': round(latencies.mean() * 1000, 1),
+    'p50_ms': round(np.percentile(latencies, 50) * 1000, 1),
+    'p95_ms': round(np.percentile(latencies, 95) * 1000, 1),
+    'p99_ms': round(np.percentile(latencies, 99) * 1000, 1),
+  }
+
+def start_app(maps_url, gemini_url, mongo):
+  # The app reads its settings when imported, so the environment is set up first
+  os.environ.update({
+    'GOOGLE_GEMINI_API_KEY': 'stub',
+    'GOOGLE_MAPS_API_KEY': 'stub',
+    'WEBSITE_DOMAIN': 'http://localhost/',
+    'MAPS_BASE_URL': maps_url,
+    'GEMINI_BASE_URL': gemini_url,
+  })
+  if mongo:
+    os.environ['MONGO_CONNECTION_STRING'] = mongo
+  else:
+    import mongomock
+    import pymongo
+    os.environ['MONGO_CONNECTION_STRING'] = 'mongodb://localhost'
+    pymongo.MongoClient = mongomock.MongoClient
+  import app
+  return app.app
+
+def run(args):
+  maps_stub.LATENCY['seconds'] = args.maps_latency
+  gemini_stub.LATENCY['seconds'] = args.gemini_latency
+  maps_server = Server(maps_stub.app)
+  gemini_server = Server(gemini_stub.app)
+  output = open(os.devnull, 'w') if not args.verbose else sys.stdout
+  with contextlib.redirect_stdout(output):
+    app_server = Server(start_app(maps_server.url, gemini_server.url, args.mongo))
+
+  results = {'cold': {}, 'warm': {}}
+  run_id = int(time.time())
+  try:
+    for number, endpoint in enumerate(args.endpoints):
+      bodies = [request_body(endpoint, city_name(i, run_id, number)) for i in range(args.requests)]
+      for phase in ('cold', 'warm'):
+        with contextlib.redirect_stdout(output):
+          results[phase][endpoint] = drive(app_server.url, endpoint, bodies, args.concurrency)
+        print('{:5} {:20} {}'.format(phase, endpoint, results[phase][endpoint]))
+    stubs = {
+      'maps': requests.get(maps_server.url + '/stub/stats').json(),
+      'gemini': requests.get(gemini_server.url + '/stub/stats').json(),
+    }
+  finally:
+    for server in (app_server, maps_server, gemini_server):
+      server.close()
+
+  return {
+    'started_at': datetime.datetime.fromtimestamp(run_id).isoformat(),
+    'config': {
+      'requests': args.requests,
+      'concurrency': args.concurrency,
+      'maps_latency': args.maps_latency,
+      'gemini_latency': args.gemini_latency,
+      'mongo': 'external' if args.mongo else 'mongomock',
+    },
+    'results': results,
+    'stub_calls': stubs,
+  }
+
+def compare(current, previous):
+  for phase, endpoints in current['results'].items():
+    for endpoint, result in endpoints.items():
+      before = previous.get('results', {}).get(phase, {}).get(endpoint)
+      if not before:
+        continue
+      changes = ['{} {} -> {}'.format(key, before[key], result[key]) for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')]
+      print('{:5} {:20} {}'.format(phase, endpoint, ', '.join(changes)))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='End to end benchmark against local Maps and Gemini stand-ins')
+  parser.add_argument('--requests', type=int, default=20, help='requests per endpoint and phase')
+  parser.add_argument('--concurrency', type=int, default=4)
+  parser.add_argument('--maps-latency', type=float, default=0.05, help='seconds added to every Maps answer')
+  parser.add_argument('--gemini-latency', type=float, default=0.5, help='seconds added to every Gemini answer')
+  parser.add_argument('--endpoints', nargs='+', default=list(ENDPOINTS), choices=ENDPOINTS)
+  parser.add_argument('--mongo', help='Mongo connection string, mongomock when missing')
+  parser.add_argument('--output', help='results file, benchmarks/results/e2e-<time>.json by default')
+  parser.add_argument('--compare', help='earlier results file to compare with')
+  parser.add_argument('--verbose', action='store_true', help='keep the app output')
+  args = parser.parse_args()
+  logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+  report = run(args)
+  path = args.output or os.path.join(RESULTS_DIR, 'e2e-{}.json'.format(report['started_at'].replace(':', '')))
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+  with open(path, 'w') as f:
+    json.dump(report, f, indent=2)
+  print('Results saved to', path)
+  if args.compare:
+    with open(args.compare) as f:
+      compare(report, json.load(f))
@@ -0,0 +1,99 @@
+import argparse
+import json
+import re
+import threading
+import time
+from flask import Flask, jsonify, request
+
+# Local stand-in for Gemini generateContent over REST. It recognises the app's prompts and
+# answers in the shape each one expects: trip parameters for the validation prompts and an
+# itinerary of the first places for the ordering prompts. Point the app at it with
+# GEMINI_BASE_URL=http://localhost:8082.
+
+app = Flask(__name__)
+LATENCY = {'seconds': 0.0}
+lock = threading.Lock()
+counts = {}
+
+CITY = re.compile(r'\b(?:to|in|of|visit)\s+([A-Z][a-zA-Z]+(?:\s[A-Z][a-zA-Z]+)?)')
+DAYS = re.compile(r'(\d+)\s*day')
+PLACES_PER_DAY = 5
+
+def served(kind):
+  with lock:
+    counts[kind] = counts.get(kind, 0) + 1
+  if LATENCY['seconds']:
+    time.sleep(LATENCY['seconds'])
+
+def user_request(prompt):
+  # The human message is wrapped in four hashtags
+  parts = prompt.split('####')
+  return parts[-2] if len(parts) >= 3 else prompt
+
+def trip_parameters(text):
+  city = CITY.search(text)
+  days = DAYS.search(text)
+  return {
+    'plan_is_valid': 'no' if 'moon' in text.lower() else 'yes',
+    'location': city.group(1) if city else 'Chicago',
+    'origin': city.group(1) if city else 'Chicago',
+    'duration': int(days.group(1)) if days else 2,
+    'no_of_people': 2,
+    'budget': 'medium',
+    'mode_of_transport': 'DRIVING',
+    'type_of_trip': 'friends',
+    'cuisine': 'italian',
+    'timings': '09:00-20:00',
+    'attractions': 'museum',
+    'distance': 40,
+  }
+
+def compact_itinerary(text):
+  rows = [line.split(',') for line in text.splitlines() if re.match(r'^\s*p\d+,', line)]
+  duration = trip_parameters(text)['duration']
+  duration = int(json.loads(text.split('PARAMETER', 1)[1].strip()).get('duration', duration)) if 'PARAMETER' in text else duration
+  chosen = rows[:PLACES_PER_DAY * duration]
+  return [{'id': row[0].strip(), 'day': 1 + i % duration, 'time': '{:02d}:00'.format(9 + 2 * (i // duration))} for i, row in enumerate(chosen)]
+
+def answer(prompt):
+  text = user_request(prompt)
+  if 'CSV table of candidate places' in prompt:
+    served('compact_ordering')
+    return json.dumps(compact_itinerary(text))
+  if 'list of JSON objects indicating details about the places' in prompt:
+    served('ordering')
+    # The full place list is hard to read back reliably, an empty plan makes the app use its own
+    return '[]'
+  if 'extract the trip parameters in the same JSON object' in prompt:
+    served('validate_and_extract')
+    return json.dumps(trip_parameters(text))
+  if 'plan_is_valid' in prompt:
+    served('validation')
+    return json.dumps({'plan_is_valid': trip_parameters(text)['plan_is_valid']})
+  served('extraction')
+  parameters = trip_parameters(text)
+  parameters.pop('plan_is_valid')
+  return json.dumps(parameters)
+
+@app.route('/v1beta/models/<path:model>', methods=['POST'])
+def generate_content(model):
+  payload = request.get_json(silent=True) or {}
+  prompt = ''.join(part.get('text', '') for content in payload.get('contents', []) for part in content.get('parts', []))
+  return jsonify({'candidates': [{
+    'content': {'role': 'model', 'parts': [{'text': answer(prompt)}]},
+    'finishReason': 'STOP',
+    'index': 0,
+  }]})
+
+@app.route('/stub/stats')
+def stats():
+  with lock:
+    return jsonify(dict(counts))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Local Gemini generateContent stand-in')
+  parser.add_argument('--port', type=int, default=8082)
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every answer')
+  args = parser.parse_args()
+  LATENCY['seconds'] = args.latency
+  app.run(port=args.port, threaded=True)
@@ -0,0 +1,49 @@
+import sys
+import os
+import time
+import numpy as np
+
+# Add the repository root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils import haversine, coordinates, calculate_centroid, within_radius_mask
+
+SIZES = [10, 1000, 100000]
+RADIUS_KM = 40
+
+def random_points(n, rng):
+  latitudes = 41.88 + rng.normal(0, 0.5, n)
+  longitudes = -87.63 + rng.normal(0, 0.5, n)
+  return [{'latitude': lat, 'longitude': lon} for lat, lon in zip(latitudes, longitudes)]
+
+def scalar_centroid(points):
+  return (sum(point['latitude'] for point in points) / len(points), sum(point['longitude'] for point in points) / len(points))
+
+def scalar_mask(points, centroid, radius_km):
+  return np.array([haversine(centroid[0], centroid[1], point['latitude'], point['longitude']) <= radius_km for point in points])
+
+def best_of(fn, repeat):
+  best = float('inf')
+  for _ in range(repeat):
+    tic = time.perf_counter()
+    result = fn()
+    best = min(best, time.perf_counter() - tic)
+  return best, result
+
+if __name__ == '__main__':
+  rng = np.random.default_rng(0)
+  print('{:>8} {:>12} {:>12} {:>8} {:>12}'.format('points', 'scalar ms', 'numpy ms', 'speedup', 'arrays ms'))
+  for size in SIZES:
+    points = random_points(size, rng)
+    repeat = 5 if size > 10000 else 50
+
+    scalar_time, scalar = best_of(lambda: scalar_mask(points, scalar_centroid(points), RADIUS_KM), repeat)
+    vector_time, vector = best_of(lambda: within_radius_mask(*coordinates(points), calculate_centroid(points), RADIUS_KM), repeat)
+    # Distance pass alone, for callers that already hold coordinate arrays
+    latitudes, longitudes = coordinates(points)
+    centroid = (latitudes.mean(), longitudes.mean())
+    arrays_time, _ = best_of(lambda: within_radius_mask(latitudes, longitudes, centroid, RADIUS_KM), repeat)
+
+    assert np.array_equal(scalar, vector), 'vectorized mask differs from scalar haversine'
+    assert np.allclose(scalar_centroid(points), calculate_centroid(points))
+    print('{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x {:>12.3f}'.format(size, scalar_time * 1000, vector_time * 1000, scalar_time / vector_time, arrays_time * 1000))
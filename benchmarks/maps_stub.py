@@ -0,0 +1,127 @@
+import argparse
+import hashlib
+import random
+import threading
+import time
+from flask import Flask, jsonify, request
+
+# Local stand-in for the Google Maps endpoints MapsClient calls. Answers are deterministic
+# for a given query or place id, so repeated runs see the same places. Point the app at it
+# with MAPS_BASE_URL=http://localhost:8081 (or DataLoader(maps_base_url=...)).
+
+app = Flask(__name__)
+LATENCY = {'seconds': 0.0}
+lock = threading.Lock()
+counts = {}
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+HOURS = ('9:00 AM – 5:00 PM', '10:00 AM – 10:00 PM', 'Open 24 hours', 'Closed', '11:00 AM – 2:30 PM, 5:00 – 10:00 PM')
+RESULTS = 20
+
+def seeded(*values):
+  return random.Random(hashlib.sha1('|'.join(str(value) for value in values).encode('utf-8')).hexdigest())
+
+def served(endpoint):
+  with lock:
+    counts[endpoint] = counts.get(endpoint, 0) + 1
+  if LATENCY['seconds']:
+    time.sleep(LATENCY['seconds'])
+
+def city_center(query):
+  # Every place of a city sits around the same point, whatever else the query asks for
+  city = query.split('+')[-1].split('|')[0].strip().lower()
+  rng = seeded('city', city)
+  return rng.uniform(25, 48), rng.uniform(-122, -71)
+
+def place(query, place_type, i):
+  rng = seeded(query, place_type, i)
+  lat, lng = city_center(query)
+  return {
+    'place_id': 'stub-{}'.format(hashlib.sha1('{}|{}|{}'.format(query, place_type, i).encode('utf-8')).hexdigest()[:20]),
+    'name': '{} {} {}'.format(query.split('+')[0] or 'Local', place_type.replace('_', ' '), i),
+    'rating': round(rng.uniform(3.0, 5.0), 1),
+    'user_ratings_total': rng.randint(5, 20000),
+    'price_level': rng.randint(1, 4),
+    'business_status': 'OPERATIONAL' if rng.random() > 0.05 else 'CLOSED_TEMPORARILY',
+    'geometry': {'location': {'lat': lat + rng.gauss(0, 0.03), 'lng': lng + rng.gauss(0, 0.03)}},
+    'types': [place_type, 'point_of_interest', 'establishment'],
+  }
+
+@app.route('/maps/api/place/textsearch/json')
+def text_search():
+  served('textsearch')
+  query = request.args.get('query', '')
+  place_type = request.args.get('type', 'point_of_interest')
+  return jsonify({'results': [place(query, place_type, i) for i in range(RESULTS)], 'status': 'OK'})
+
+@app.route('/maps/api/place/details/json')
+def place_details():
+  served('details')
+  rng = seeded('details', request.args.get('place_id', ''))
+  return jsonify({'result': {
+    'current_opening_hours': {'weekday_text': ['{}: {}'.format(day, rng.choice(HOURS)) for day in WEEKDAYS]},
+    'editorial_summary': {'overview': 'A stand-in place used for local testing.'},
+    'website': 'https://example.com/{}'.format(request.args.get('place_id', '')),
+    'serves_lunch': rng.random() > 0.5,
+    'serves_dinner': rng.random() > 0.3,
+  }, 'status': 'OK'})
+
+def leg(origin, destination, mode):
+  rng = seeded('route', origin, destination, mode)
+  meters = rng.randint(500, 30000)
+  seconds = int(meters / {'walking': 1.3, 'bicycling': 4.5, 'transit': 6.0}.get(str(mode).lower(), 11.0))
+  return meters, seconds
+
+@app.route('/maps/api/directions/json')
+def directions():
+  served('directions')
+  meters, seconds = leg(request.args.get('origin'), request.args.get('destination'), request.args.get('mode', 'driving'))
+  return jsonify({'routes': [{'legs': [{
+    'distance': {'value': meters, 'text': '{:.1f} km'.format(meters / 1000)},
+    'duration': {'value': seconds, 'text': '{} mins'.format(seconds // 60)},
+  }]}], 'status': 'OK'})
+
+def v1_places(payload, endpoint):
+  query = payload.get('textQuery') or str(payload.get('locationRestriction', ''))
+  places = []
+  for i in range(min(int(payload.get('maxResultCount', RESULTS)), RESULTS)):
+    legacy = place(query, endpoint, i)
+    places.append({
+      'id': legacy['place_id'],
+      'displayName': {'text': legacy['name']},
+      'location': {'latitude': legacy['geometry']['location']['lat'], 'longitude': legacy['geometry']['location']['lng']},
+      'rating': legacy['rating'],
+      'userRatingCount': legacy['user_ratings_total'],
+      'types': legacy['types'],
+    })
+  return {'places': places}
+
+@app.route('/v1/places:searchText', methods=['POST'])
+def search_text():
+  served('searchText')
+  return jsonify(v1_places(request.get_json(silent=True) or {}, 'search_text'))
+
+@app.route('/v1/places:searchNearby', methods=['POST'])
+def search_nearby():
+  served('searchNearby')
+  return jsonify(v1_places(request.get_json(silent=True) or {}, 'search_nearby'))
+
+@app.route('/directions/v2:computeRoutes', methods=['POST'])
+def compute_routes():
+  served('computeRoutes')
+  payload = request.get_json(silent=True) or {}
+  meters, seconds = leg(payload.get('origin'), payload.get('destination'), payload.get('travelMode', 'DRIVE'))
+  return jsonify({'routes': [{'distanceMeters': meters, 'duration': '{}s'.format(seconds)}]})
+
+@app.route('/stub/stats')
+def stats():
+  with lock:
+    return jsonify(dict(counts))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Local Google Maps stand-in')
+  parser.add_argument('--port', type=int, default=8081)
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every answer')
+  args = parser.parse_args()
+  LATENCY['seconds'] = args.latency
+  app.run(port=args.port, threaded=True)
@@ -0,0 +1,317 @@
+import datetime
+import hashlib
+import json
+import re
+import threading
+import cachetools
+import pymongo
+from pymongo import ReplaceOne
+from .hours import trip_start
+from .constants import CACHE_TRIM_EVERY
+from .tracing import span
+from .log import get_logger
+
+logger = get_logger('cache')
+
+DUPLICATE_KEY_ERROR = 11000
+# Upper bounds in seconds of the age at hit histogram
+AGE_BUCKETS = (60, 60 * 60, 6 * 60 * 60, 24 * 60 * 60, 3 * 24 * 60 * 60, 7 * 24 * 60 * 60, 30 * 24 * 60 * 60)
+
+def utcnow():
+    # Naive UTC, the way pymongo hands back stored dates
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def age_bucket(age):
+    for bound in AGE_BUCKETS:
+        if age <= bound:
+            return '<={}s'.format(bound)
+    return '>{}s'.format(AGE_BUCKETS[-1])
+
+def cache_key(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True, default=str)
+
+# Plan parameters that change the itinerary, everything else is left out of the LLMCache key
+PLAN_FIELDS = ('location', 'origin', 'cuisine', 'attractions', 'budget', 'timings', 'distance', 'duration', 'no_of_people', 'type_of_trip', 'mode_of_transport')
+LIST_FIELDS = {'location', 'cuisine', 'attractions'}
+INT_FIELDS = {'distance', 'duration', 'no_of_people'}
+LIST_SEPARATOR = re.compile(r'\s*[|,]\s*')
+TIME = re.compile(r'(\d{1,2}):(\d{2})')
+
+def canonical_params(params):
+    canonical = {}
+    for field in PLAN_FIELDS:
+        value = params.get(field)
+        if value is None:
+            continue
+        if field in INT_FIELDS:
+            value = int(value)
+        elif field in LIST_FIELDS:
+            value = '|'.join(sorted({item.lower() for item in LIST_SEPARATOR.split(str(value).strip()) if item}))
+        elif field == 'timings':
+            value = TIME.sub(lambda m: '{:02d}:{}'.format(int(m.group(1)), m.group(2)), str(value).replace(' ', ''))
+        else:
+            value = ' '.join(str(value).lower().split())
+        canonical[field] = value
+    # Opening hours are checked per trip day, so plans starting on another weekday differ.
+    # Without a start_date a plan starts today, keying it on that would change every key at midnight.
+    if params.get('start_date'):
+        canonical['start_weekday'] = trip_start(params).weekday()
+    return canonical
+
+def plan_cache_key(params):
+    canonical = json.dumps(canonical_params(params), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+class _CountingTTLCache(cachetools.TTLCache):
+    def __init__(self, maxsize, ttl, on_evict):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.on_evict = on_evict
+
+    def popitem(self):
+        item = super().popitem()
+        self.on_evict('evictions', 1)
+        return item
+
+    def expire(self, time=None):
+        before = cachetools.Cache.__len__(self)
+        super().expire(time)
+        expired = before - cachetools.Cache.__len__(self)
+        if expired:
+            self.on_evict('expirations', expired)
+
+class MemoryCache(object):
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.lock = threading.RLock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        self.cache = _CountingTTLCache(maxsize, ttl, self._count)
+
+    def _count(self, name, value=1):
+        self.counters[name] += value
+
+    def get(self, key):
+        with self.lock:
+            value = self.cache.get(key)
+            self._count('hits' if value is not None else 'misses')
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, 'size': len(self.cache), 'maxsize': self.cache.maxsize, 'ttl': self.cache.ttl}
+
+class CachedCollection(object):
+    # Memory tier in front of a Mongo collection whose documents are looked up by a single field.
+    # Writes stamp documents with cached_at. With a policy, documents older than policy['fresh']
+    # are still returned but refresh(key, document) is run on executor to replace them, documents
+    # older than policy['expire'] are misses (the TTL index deletes them soon after), and the
+    # collection is trimmed to policy['max_documents'] oldest first. Refreshes run on
+    # refresh_executor when given, at most refresh_limit at once, the others are skipped.
+    # Documents handed out by find_one and find_many are shared by every caller through the
+    # memory tier, callers must treat them as read only and copy before changing anything.
+    def __init__(self, collection, key_field, maxsize, ttl, policy=None, refresh=None, executor=None, trim_every=CACHE_TRIM_EVERY, refresh_executor=None, refresh_limit=None):
+        self.collection = collection
+        self.key_field = key_field
+        self.memory = MemoryCache(collection.name, maxsize, ttl)
+        self.policy = policy
+        self.refresh = refresh
+        self.executor = executor
+        self.refresh_executor = refresh_executor or executor
+        self.refresh_slots = threading.BoundedSemaphore(refresh_limit) if refresh_limit else None
+        self.trim_every = trim_every
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.writes = 0
+        self.counters = {'stale_hits': 0, 'expired': 0, 'refreshed': 0, 'refresh_failed': 0, 'refresh_skipped': 0, 'trimmed': 0}
+        self.ages = {}
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def _check(self, key, document, policy=None):
+        # Returns the document if it can be served, scheduling a refresh when it is stale
+        policy = policy or self.policy
+        if document is None or policy is None:
+            return document
+        cached_at = document.get('cached_at')
+        if not isinstance(cached_at, datetime.datetime):
+            return document
+        age = (utcnow() - cached_at).total_seconds()
+        with self.lock:
+            bucket = age_bucket(age)
+            self.ages[bucket] = self.ages.get(bucket, 0) + 1
+        if age > policy['expire']:
+            self._count('expired')
+            return None
+        if age > policy['fresh']:
+            self._count('stale_hits')
+            self._schedule_refresh(key, document)
+        return document
+
+    def _schedule_refresh(self, key, document):
+        if self.refresh is None or self.refresh_executor is None:
+            return
+        memory_key = cache_key(key)
+        with self.lock:
+            if memory_key in self.refreshing:
+                self.counters['refresh_skipped'] += 1
+                return
+            if self.refresh_slots is not None and not self.refresh_slots.acquire(blocking=False):
+                self.counters['refresh_skipped'] += 1
+                return
+            self.refreshing.add(memory_key)
+        try:
+            self.refresh_executor.submit(self._refresh, key, memory_key, document)
+        except RuntimeError:
+            self._refreshed(memory_key)
+
+    def _refreshed(self, memory_key):
+        with self.lock:
+            self.refreshing.discard(memory_key)
+        if self.refresh_slots is not None:
+            self.refresh_slots.release()
+
+    def _refresh(self, key, memory_key, document):
+        try:
+            self.refresh(key, document)
+            self._count('refreshed')
+        except Exception as e:
+            self._count('refresh_failed')
+            logger.warning('Refresh of %s %s failed: %s', self.collection.name, key, e)
+        finally:
+            self._refreshed(memory_key)
+
+    def _stamp(self, document):
+        return {**document, 'cached_at': utcnow()}
+
+    def _written(self, count):
+        if self.policy is None or not self.policy.get('max_documents'):
+            return
+        with self.lock:
+            before = self.writes
+            self.writes += count
+            due = before // self.trim_every != self.writes // self.trim_every
+        if due and self.executor is not None:
+            try:
+                self.executor.submit(self.trim)
+            except RuntimeError:
+                pass
+
+    def trim(self):
+        # Deletes the oldest documents above policy['max_documents']
+        try:
+            extra = self.collection.estimated_document_count() - self.policy['max_documents']
+            if extra <= 0:
+                return 0
+            cursor = self.collection.find({}, {'_id': 1}).sort('cached_at', pymongo.ASCENDING).limit(extra)
+            ids = [document['_id'] for document in cursor]
+            if ids:
+                self.collection.delete_many({'_id': {'$in': ids}})
+            self._count('trimmed', len(ids))
+            return len(ids)
+        except pymongo.errors.PyMongoError as e:
+            logger.warning('Trimming %s failed: %s', self.collection.name, e)
+            return 0
+
+    def find_one(self, key, policy=None):
+        # policy replaces the collection's policy for documents that live shorter or longer
+        with span('cache.' + self.collection.name) as timed:
+            memory_key = cache_key(key)
+            document = self.memory.get(memory_key)
+            if document is None:
+                document = self.collection.find_one({self.key_field: key})
+                if document is not None:
+                    self.memory.set(memory_key, document)
+            document = self._check(key, document, policy)
+            timed.cache = 'miss' if document is None else 'hit'
+        return document
+
+    def find_many(self, keys, policy=None):
+        with span('cache.' + self.collection.name) as timed:
+            found = self._find_many(keys, policy)
+            timed.cache = 'hit' if len(found) == len(set(keys)) else ('miss' if not found else 'partial')
+        return found
+
+    def _find_many(self, keys, policy=None):
+        # Returns {key: document} for the keys found, misses go to Mongo in a single $in query
+        found = {}
+        missing = []
+        for key in keys:
+            document = self.memory.get(cache_key(key))
+            if document is None:
+                missing.append(key)
+            else:
+                found[key] = document
+        if missing:
+            for document in self.collection.find({self.key_field: {'$in': missing}}):
+                key = document[self.key_field]
+                found[key] = document
+                self.memory.set(cache_key(key), document)
+        checked = {key: self._check(key, document, policy) for key, document in found.items()}
+        return {key: document for key, document in checked.items() if document is not None}
+
+    def insert_many(self, documents):
+        if not documents:
+            return
+        documents = [self._stamp(document) for document in documents]
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # Concurrent writers may have stored some of these already, anything else is a real failure
+            if any(error['code'] != DUPLICATE_KEY_ERROR for error in e.details.get('writeErrors', [])):
+                raise
+        for document in documents:
+            self.memory.set(cache_key(document[self.key_field]), document)
+        self._written(len(documents))
+
+    def insert_one(self, document):
+        document = self._stamp(document)
+        self.collection.insert_one(document)
+        self.memory.set(cache_key(document[self.key_field]), document)
+        self._written(1)
+
+    def upsert_one(self, document):
+        # Replaces any document stored under the same key, so racing writers leave a single copy
+        document = self._stamp(document)
+        document.pop('_id', None)
+        key = document[self.key_field]
+        self.collection.replace_one({self.key_field: key}, document, upsert=True)
+        self.memory.set(cache_key(key), document)
+        self._written(1)
+
+    def upsert_many(self, documents):
+        # upsert_one for a batch in one round trip, stored copies (e.g. expired ones) are replaced
+        if not documents:
+            return
+        documents = [self._stamp(document) for document in documents]
+        for document in documents:
+            document.pop('_id', None)
+        self.collection.bulk_write([ReplaceOne({self.key_field: document[self.key_field]}, document, upsert=True) for document in documents], ordered=False)
+        for document in documents:
+            self.memory.set(cache_key(document[self.key_field]), document)
+        self._written(len(documents))
+
+    def merge_one(self, document, restamp=True):
+        # Sets the fields of document on the stored copy, created when missing, and keeps its other
+        # fields. Without restamp an existing copy keeps its cached_at.
+        fields = {key: value for key, value in document.items() if key != '_id'}
+        update = {'$set': fields}
+        if restamp:
+            fields['cached_at'] = utcnow()
+        else:
+            update['$setOnInsert'] = {'cached_at': utcnow()}
+        key = fields[self.key_field]
+        stored = self.collection.find_one_and_update({self.key_field: key}, update, upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+        self.memory.set(cache_key(key), stored)
+        self._written(1)
+        return stored
+
+    def stats(self):
+        with self.lock:
+            return {**self.memory.stats(), **self.counters, 'refreshing': len(self.refreshing), 'age_at_hit': dict(self.ages)}
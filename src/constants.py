@@ -1,2 +1,84 @@
 MODEL_NAME = 'gemini-1.0-pro-latest'
 TEMPERATURE = 0
+# Validate and extract trip parameters with one Gemini call, the two call chain stays as fallback
+SINGLE_CALL_EXTRACTION = True
+
+# Google Maps client
+MAPS_TIMEOUT = (3.05, 10)
+MAPS_MAX_RETRIES = 3
+MAPS_BACKOFF_BASE = 0.25
+MAPS_BACKOFF_MAX = 8
+MAPS_MAX_CONCURRENCY = 20
+# Requests per second allowed for each endpoint
+MAPS_RATE_LIMITS = {
+    'textsearch': 10,
+    'details': 50,
+    'nearbysearch': 10,
+    'directions': 20,
+    'routes': 20,
+}
+
+# In-process cache tier in front of the Mongo caches: (max entries, ttl in seconds)
+MEMORY_CACHE_LIMITS = {
+    'GoogleMapsAPI': (512, 6 * 60 * 60),
+    'PlacesCache': (4096, 6 * 60 * 60),
+    'LLMCache': (1024, 60 * 60),
+    'RouteLegs': (4096, 60 * 60),
+}
+
+# Mongo cache lifetimes in seconds: served as is until fresh, served while refreshed in the
+# background until expire (also the TTL index), max_documents caps the collection size
+CACHE_POLICIES = {
+    'GoogleMapsAPI': {'fresh': 24 * 60 * 60, 'expire': 7 * 24 * 60 * 60, 'max_documents': 20000},
+    'PlacesCache': {'fresh': 3 * 24 * 60 * 60, 'expire': 30 * 24 * 60 * 60, 'max_documents': 200000},
+    'LLMCache': {'fresh': 24 * 60 * 60, 'expire': 14 * 24 * 60 * 60, 'max_documents': 20000},
+    # Each leg is looked up with its ROUTE_LEG_POLICIES entry, this one only sets the TTL index and cap
+    'RouteLegs': {'fresh': 7 * 24 * 60 * 60, 'expire': 30 * 24 * 60 * 60, 'max_documents': 100000},
+}
+# Route leg lifetimes by how quickly the answer changes: driving with traffic, transit schedules,
+# and walking, cycling or traffic unaware driving that only follow the road network
+ROUTE_LEG_POLICIES = {
+    'traffic': {'fresh': 10 * 60, 'expire': 60 * 60},
+    'schedule': {'fresh': 60 * 60, 'expire': 24 * 60 * 60},
+    'static': {'fresh': 7 * 24 * 60 * 60, 'expire': 30 * 24 * 60 * 60},
+}
+# Decimals kept of leg coordinates without a place id, 4 is about 11 m
+ROUTE_LEG_PRECISION = 4
+# Legs a single batch request may ask for
+ROUTE_LEGS_MAX = 25
+# Google statuses worth caching, anything else is answered but not stored
+MAPS_CACHEABLE_STATUSES = ('OK', 'ZERO_RESULTS')
+# Writes between two checks of a collection's size cap
+CACHE_TRIM_EVERY = 500
+# Stale plans being rebuilt in the background at the same time
+PLAN_REFRESH_CONCURRENCY = 2
+
+# Spatial index over cached places
+SPATIAL_CELL_DEGREES = 0.1
+# Grid cells kept in memory, the least recently used are dropped and re-read from PlacesCache
+SPATIAL_MAX_CELLS = 4096
+# Nearby lookups are answered locally when at least this many cached places match
+NEARBY_MIN_RESULTS = 5
+# Largest nearby search radius, Google's own limit, which also bounds the grid cells a local lookup reads
+NEARBY_MAX_RADIUS_METERS = 50000.0
+
+# Seconds a single flight follower waits for its leader before running the call itself
+SINGLE_FLIGHT_TIMEOUT = 60.0
+# Plans wait longer, a cold plan runs searches, details and the LLM one after the other
+PLAN_FLIGHT_TIMEOUT = 180.0
+
+# Seconds Engine.order waits for the LLM before answering with the deterministic plan
+LLM_ORDER_DEADLINE = 8.0
+LLM_MAX_CONCURRENCY = 8
+# Send generate_trip a CSV table of short ids and needed fields instead of the full place dicts
+COMPACT_PLACE_ENCODING = True
+
+# Logging profiles, LOG_PROFILE in the environment picks one. sample_rate is the share of
+# DEBUG payload logs that include the payload itself (cut to max_chars), the rest log a summary.
+LOG_PROFILE = 'development'
+LOG_PROFILES = {
+    'development': {'level': 'DEBUG', 'format': 'text', 'payload_sample_rate': 1.0, 'payload_max_chars': 2000},
+    'production': {'level': 'INFO', 'format': 'json', 'payload_sample_rate': 0.0, 'payload_max_chars': 0},
+}
+# Records waiting for the log writer thread, more are dropped
+LOG_QUEUE_SIZE = 10000
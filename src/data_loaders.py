@@ -1,149 +1,521 @@
 import sys
 import os
-import requests
+import logging
 from flask import jsonify
 import pymongo
 import concurrent.futures
+import threading
+import time
+import hashlib
+import json
+from .cache import CachedCollection, plan_cache_key
+from .constants import MEMORY_CACHE_LIMITS, CACHE_POLICIES, PLAN_REFRESH_CONCURRENCY, NEARBY_MIN_RESULTS, MAPS_CACHEABLE_STATUSES, ROUTE_LEGS_MAX, NEARBY_MAX_RADIUS_METERS, PLAN_FLIGHT_TIMEOUT
+from .maps_client import MapsClient
+from .singleflight import SingleFlight
+from .spatial import SpatialIndex, backfill_cells, grid_cell, place_location
+from .hours import opening_intervals, hours_stats
+from .legs import LEG_FIELD_MASK, leg_point, leg_key, leg_policy, leg_summary, routes_payload
+from .places import to_public
+from .tracing import record, span, submit
+from .log import get_logger, log_event
 from .utils import get_top_n_places, clean_google_maps_data, calculate_minmax_score, stats_printer
 
 # Add the parent directory of 'src' to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-print(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.llm.agent import Agent, enrich_params
+from src.llm.agent import get_agent, enrich_params
 from src.engine import Engine
 
+logger = get_logger('data_loaders')
+PLACE_DETAILS_FIELDS = 'current_opening_hours,serves_breakfast,serves_lunch,serves_brunch,serves_dinner,editorial_summary,website'
+
+def cacheable(body):
+    # Places and Directions answers carry a status, Routes API answers only an error when they fail
+    return isinstance(body, dict) and 'error' not in body and body.get('status', 'OK') in MAPS_CACHEABLE_STATUSES
+
+def refused(body):
+    # Why a refresh keeps the stale document instead of this answer
+    if not isinstance(body, dict):
+        return 'UNKNOWN_ERROR'
+    error = body.get('error')
+    if error is not None:
+        return error.get('status', 'ERROR') if isinstance(error, dict) else 'ERROR'
+    return body.get('status', 'ERROR')
+
+def response_fields(body):
+    # A Google response as GoogleMapsAPI keeps it for the /maps/* passthrough, with its ETag
+    etag = hashlib.sha1(json.dumps(body, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+    return {'raw': body, 'etag': etag}
+
+def stored_response(document):
+    # The full Google response of a GoogleMapsAPI document, None when only its places were kept
+    if document is None:
+        return None
+    if 'raw' in document:
+        return document
+    if 'response' in document and document.get('top_n') is None:
+        # Stored before raw responses were, the places are the untouched results
+        body = {'html_attributions': [], 'results': document['response'], 'status': 'OK' if document['response'] else 'ZERO_RESULTS'}
+        return {**response_fields(body), 'cached_at': document.get('cached_at')}
+    return None
+
+def place_details(place, body):
+    details = { **place, **body.get('result', {}) }
+    # Opening hours are parsed once here and stored with the details in PlacesCache
+    details['opening_intervals'] = opening_intervals(details)
+    return details
+
 class DataLoader(object):
-    def __init__(self, maps_api_key, mongo_connection_string, gemini_api_key):
+    def __init__(self, maps_api_key, mongo_connection_string, gemini_api_key, maps_base_url=None, gemini_base_url=None):
         self.gemini_api_key = gemini_api_key
         self.maps_api_key = maps_api_key
+        self.maps = MapsClient(maps_api_key, base_url=maps_base_url)
         mongo_client = pymongo.MongoClient(mongo_connection_string)
-        mongo_db = mongo_client.get_database('TripTonicDump')
-        self.gmaps_collection = pymongo.collection.Collection(mongo_db, 'GoogleMapsAPI')
-        self.places_collection = pymongo.collection.Collection(mongo_db, 'PlacesCache')
-        self.llm_collection = pymongo.collection.Collection(mongo_db, 'LLMCache')
+        self.mongo_db = mongo_client.get_database('TripTonicDump')
+        self.gmaps_collection = self.mongo_db.get_collection('GoogleMapsAPI')
+        self.places_collection = self.mongo_db.get_collection('PlacesCache')
+        self.llm_collection = self.mongo_db.get_collection('LLMCache')
+        self.legs_collection = self.mongo_db.get_collection('RouteLegs')
         self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=20)
-        self.engine = Engine()
+        # Stale plans are rebuilt on their own few workers, a plan waits on fetches it submits
+        # to self.executor and must not hold the workers those fetches need
+        self.plan_executor = concurrent.futures.ThreadPoolExecutor(max_workers=PLAN_REFRESH_CONCURRENCY)
+        self.gmaps_cache = self.cached_collection(self.gmaps_collection, 'url', self.refresh_search)
+        self.places_cache = self.cached_collection(self.places_collection, 'place_id', self.refresh_place_details)
+        self.llm_cache = self.cached_collection(self.llm_collection, 'key', self.refresh_plan, refresh_executor=self.plan_executor, refresh_limit=PLAN_REFRESH_CONCURRENCY)
+        self.legs_cache = self.cached_collection(self.legs_collection, 'key', self.refresh_leg)
+        self.plan_flight = SingleFlight('plans', PLAN_FLIGHT_TIMEOUT)
+        self.search_flight = SingleFlight('searches')
+        self.details_flight = SingleFlight('place_details')
+        self.response_flight = SingleFlight('maps_responses')
+        self.leg_flight = SingleFlight('route_legs')
+        self.spatial = SpatialIndex(self.places_collection)
+        self.executor.submit(self.backfill_spatial_index)
+        self.agent = get_agent(gemini_api_key, base_url=gemini_base_url)
+        self.engine = Engine(gemini_base_url=gemini_base_url)
+
+    def cached_collection(self, collection, key_field, refresh, **kwargs):
+        return CachedCollection(
+            collection, key_field, *MEMORY_CACHE_LIMITS[collection.name],
+            policy=CACHE_POLICIES[collection.name], refresh=refresh, executor=self.executor, **kwargs
+        )
+
+    def refresh_search(self, url, document):
+        # Runs a stale text search again, detailed searches also refresh their top places.
+        # Error answers, and no results for a search that had some, leave the stale document
+        # in place and count as a failed refresh.
+        top_n = document.get('top_n')
+        body = self.maps.text_search(url).json()
+        if not cacheable(body):
+            raise RuntimeError('Maps answered {}'.format(refused(body)))
+        results = body.get('results', [])
+        if not results and (document.get('response') or document.get('raw', {}).get('results')):
+            raise RuntimeError('Maps answered {} for a search that had results'.format(refused(body)))
+        if 'response' not in document:
+            # Only searched by the /maps/* passthrough so far
+            self.gmaps_cache.merge_one({'url': url, **response_fields(body)})
+            return
+        if top_n is None:
+            self.save_places(url, results, raw=body)
+            # Transit stops are not in PlacesCache, so they only reach the grid in memory and
+            # are gone after a restart until their search runs again
+            self.spatial.add_many(results)
+            return
+        results = get_top_n_places(top_n, results)
+        details = self.lookup_place_details(results)
+        missing = [i for i, place in enumerate(details) if place is None]
+        for i in missing:
+            details[i] = self.fetch_place_details(results[i])
+        self.save_place_details([details[i] for i in missing])
+        self.save_places(url, details, top_n, raw=body)
+
+    def refresh_place_details(self, place_id, document):
+        place = {key: value for key, value in document.items() if key not in ('_id', 'cached_at', 'opening_intervals')}
+        body = self.maps.place_details(place_id, PLACE_DETAILS_FIELDS).json()
+        if not cacheable(body) or not body.get('result'):
+            raise RuntimeError('Maps answered {}'.format(refused(body)))
+        details = place_details(place, body)
+        lat, lng = place_location(details)
+        if lat is not None and lng is not None:
+            details['cell'] = grid_cell(lat, lng)
+        self.places_cache.upsert_one(details)
+        self.spatial.add_many([details])
+
+    def refresh_leg(self, key, document):
+        # Asks again with the stored request, Directions legs by the /maps/route/* endpoints
+        # and Routes API legs by the batch endpoint
+        if document.get('directions') is not None:
+            body = self.maps.directions(document['directions']).json()
+        else:
+            body = self.maps.compute_routes(document['routes'], LEG_FIELD_MASK).json()
+        if not cacheable(body):
+            raise RuntimeError('Maps answered {}'.format(refused(body)))
+        self.legs_cache.merge_one({'key': key, **response_fields(body)})
+
+    def refresh_plan(self, key, document):
+        # Plans again from fresh places, identical foreground plans wait for this one. Runs on
+        # self.plan_executor, PLAN_REFRESH_CONCURRENCY at most, the llm_cache skips the others.
+        self.plan_flight.do(key, self.build_plan, key, document['input'])
 
     def extract_params(self, query):
-        travel_agent = Agent(google_gemini_key=self.gemini_api_key, debug=True)
-        return travel_agent.validate_travel(query)
+        return self.agent.validate_travel(query)
     
-    def apply_filters(self, input):
-        params = input
+    def prepare_input(self, input):
         input['location'] = input.get('location', '').replace(", ", '|')
         input['cuisine'] = input.get('cuisine', '').replace(", ", '|')
         input['budget'] = input.get('budget', '')
         input['timings'] = input.get('timings', '')
         input['origin'] = input.get('origin', '')
 
-        input = enrich_params(input)
-        res = self.llm_collection.find_one({'input': input})
-
-        if res is None:
-            import time
-            tic = time.time()
-            places = {} 
-            places['restaurant'] = clean_google_maps_data('restaurant', self.get_restaurants(input['cuisine'], input['location']))
-            places['transit'] = clean_google_maps_data('transit', calculate_minmax_score(self.get_transit(input['location'])[:10]))
-            places['tourist'] = clean_google_maps_data('tourist', self.get_tourist('', input['location']))
-            tac = time.time()
-            print('Total restaurants:', len(places['restaurant']))
-            print('Total transits:', len(places['transit']))
-            print('Total tourists:', len(places['tourist']))
-            print("Time to fetch places: {}".format(round(tac - tic, 2)))
-            data = self.engine.filter(places, input)
-            print('After filtering length:', len(data))
-            stats_printer(data)
-            data = self.engine.order(data, input)
-            print('After ordering length:', len(data))
-            stats_printer(data)
-            res = {'input': input, 'data': data}
-            self.llm_collection.insert_one(res)
+        return enrich_params(input)
+
+    def iter_apply_filters(self, input):
+        # Yields (stage, payload) as the plan progresses, the last stage is the full result
+        input = self.prepare_input(input)
+        key = plan_cache_key(input)
+        res = self.llm_cache.find_one(key)
+
+        while res is None:
+            # Identical concurrent plans wait for the first one, and take over if it fails
+            call, leader = self.plan_flight.begin(key)
+            if not leader:
+                try:
+                    res = call.wait(self.plan_flight.timeout)
+                except TimeoutError:
+                    self.plan_flight.abandon(key, call)
+                continue
+            try:
+                res = self.llm_cache.find_one(key)
+                if res is not None:
+                    break
+                for stage, payload in self.iter_plan(key, input):
+                    if stage == 'plan':
+                        res = payload
+                    else:
+                        yield stage, payload
+            finally:
+                self.plan_flight.finish(key, call, res)
 
         results = {}
         results['places'] = res['data']
-        results['prompt'] = params
-        return jsonify(results)
+        results['prompt'] = input
+        results['ordering'] = res.get('ordering')
+        yield 'itinerary', results
+
+    def iter_plan(self, key, input):
+        # Fetches, filters and orders places, stores the plan in LLMCache and yields it last as 'plan'
+        places = {}
+        for category, category_places in self.iter_places(input):
+            places[category] = category_places
+            yield 'places', {'type': category, 'places': to_public(category_places)}
+        data = self.engine.filter(places, input)
+        stats_printer(data, 'filtered')
+        yield 'filtered', {'places': to_public(data)}
+        lock = threading.Lock()
+        late = {'stored': False, 'plan': None}
+
+        def save_late_plan(data, ordering):
+            # A late LLM plan replaces the fallback plan. One that arrives before the fallback
+            # is stored is left for the request to write after it, nothing waits here.
+            plan = {'key': key, 'input': input, 'data': to_public(data), 'ordering': ordering}
+            with lock:
+                if not late['stored']:
+                    late['plan'] = plan
+                    return
+            self.llm_cache.upsert_one(plan)
+
+        data, ordering = self.engine.order_with_source(data, input, on_late_result=save_late_plan)
+        stats_printer(data, 'ordered')
+        res = {'key': key, 'input': input, 'data': to_public(data), 'ordering': ordering}
+        self.llm_cache.upsert_one(res)
+        with lock:
+            late['stored'] = True
+        if late['plan'] is not None:
+            self.llm_cache.upsert_one(late['plan'])
+        yield 'plan', res
+
+    def build_plan(self, key, input):
+        for stage, payload in self.iter_plan(key, input):
+            if stage == 'plan':
+                return payload
+
+    def apply_filters(self, input):
+        for _, results in self.iter_apply_filters(input):
+            pass
+        with span('serialize'):
+            return jsonify(results)
     
     def prompt(self, query):
         input = self.extract_params(query)
         return self.apply_filters(input)
+
+    def prompt_stream(self, query):
+        input = self.extract_params(query)
+        yield 'params', dict(input)
+        yield from self.iter_apply_filters(input)
     
     def places(self):
         pass
 
+    def cache_stats(self):
+        return {
+            'GoogleMapsAPI': self.gmaps_cache.stats(),
+            'PlacesCache': self.places_cache.stats(),
+            'LLMCache': self.llm_cache.stats(),
+            'RouteLegs': self.legs_cache.stats(),
+            'single_flight': {
+                'plans': self.plan_flight.stats(),
+                'searches': self.search_flight.stats(),
+                'place_details': self.details_flight.stats(),
+                'maps_responses': self.response_flight.stats(),
+                'route_legs': self.leg_flight.stats(),
+            },
+            'spatial_index': self.spatial.stats(),
+            'opening_hours': hours_stats(),
+        }
+
+    def fetch_place_details(self, place):
+        return self.details_flight.do(place.get('place_id'), self._fetch_place_details, place)
+
+    def _fetch_place_details(self, place):
+        response = self.maps.place_details(place.get('place_id'), PLACE_DETAILS_FIELDS)
+        return place_details(place, response.json())
+
+    def lookup_place_details(self, places):
+        # Resolves the cached details of every place with one $in query, None marks a miss
+        cached = self.places_cache.find_many([place.get('place_id') for place in places])
+        return [cached.get(place.get('place_id')) for place in places]
+
+    def save_place_details(self, places):
+        documents = []
+        for place in places:
+            lat, lng = place_location(place)
+            documents.append({**place, 'cell': grid_cell(lat, lng)} if lat is not None and lng is not None else {**place})
+        # Refetched places replace their expired copies
+        self.places_cache.upsert_many(documents)
+        self.spatial.add_many(places)
+
+    def backfill_spatial_index(self):
+        try:
+            updated = backfill_cells(self.places_collection)
+            self.spatial.invalidate()
+            logger.info('Spatial index backfilled %s places', updated)
+        except Exception as e:
+            logger.warning('Spatial index backfill failed: %s', e)
+
+    def nearby_places(self, latitude, longitude, radius_km, place_type=None, limit=10):
+        # Cached places around a point, None when local coverage is too thin to skip Google
+        radius_km = min(radius_km, NEARBY_MAX_RADIUS_METERS / 1000)
+        places = self.spatial.nearby(latitude, longitude, radius_km, place_type, limit)
+        if len(places) < min(NEARBY_MIN_RESULTS, limit or NEARBY_MIN_RESULTS):
+            return None
+        return places
+
+    def get_places_details(self, places, details=None):
+        # Keeps the ranking order of places, only the cache misses hit the Places API
+        if details is None:
+            details = self.lookup_place_details(places)
+        missing = [i for i, place in enumerate(details) if place is None]
+        futures = {i: submit(self.executor, self.fetch_place_details, places[i]) for i in missing}
+        for i, future in futures.items():
+            details[i] = future.result()
+        self.save_place_details([details[i] for i in missing])
+        return details
+
     def get_place_details(self, place):
-        place_id = place.get('place_id')
-        response_data = self.places_collection.find_one({'place_id': place_id})
-        if response_data is None:
-            fields = 'current_opening_hours,serves_breakfast,serves_lunch,serves_brunch,serves_dinner,editorial_summary,website'
-            url = f"https://maps.googleapis.com/maps/api/place/details/json?place_id={place_id}&fields={fields}&key={self.maps_api_key}"
-            response = requests.get(url)
-            details = response.json().get('result', {})
-            enriched_place = { **place, **details }
-            self.places_collection.insert_one({**enriched_place})
-            return enriched_place
-        return response_data
+        return self.get_places_details([place])[0]
 
-    def get_restaurants(self, cuisines, cities):
+    def restaurants_url(self, cuisines, cities):
         query = f"{cuisines}+{cities}"
-        url = f"https://maps.googleapis.com/maps/api/place/textsearch/json?query={query}&type=restaurant&key={self.maps_api_key}"
-        document = self.gmaps_collection.find_one({'url': url})
-        if document is None:
-            response = requests.get(url)
-            response_data = response.json()
-            results = response_data.get('results', [])
-
-            # Filter for top 10 results here only
-            results = get_top_n_places(10, results)
-
-            detailed_places = []
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = [executor.submit(self.get_place_details, place) for place in results]
-                for future in concurrent.futures.as_completed(futures):
-                    fields_data = future.result()
-                    detailed_places.append(fields_data)
-            self.gmaps_collection.insert_one({'url': url, 'response': detailed_places})
-            return detailed_places
-        return document['response']
+        return self.maps.text_search_url(query, 'restaurant')
 
-    def get_tourist(self, neighborhood, cities):
+    def tourist_url(self, neighborhood, cities):
         query = f"{neighborhood}+{cities}"
-        url = f"https://maps.googleapis.com/maps/api/place/textsearch/json?query={query}&type=tourist_attraction&key={self.maps_api_key}"
-        document = self.gmaps_collection.find_one({'url': url})
-        if document is None:
-            response = requests.get(url)
-            response_data = response.json()
-            results = response_data.get('results', [])
-
-            # Filter for top 10 results here only
-            results = get_top_n_places(10, results)
-
-            detailed_places = []
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = [executor.submit(self.get_place_details, place) for place in results]
-                for future in concurrent.futures.as_completed(futures):
-                    fields_data = future.result()
-                    detailed_places.append(fields_data)
-            self.gmaps_collection.insert_one({'url': url, 'response': detailed_places})
-            return detailed_places
-        return document['response']
+        return self.maps.text_search_url(query, 'tourist_attraction')
+
+    def transit_url(self, cities):
+        query = f"{cities}"
+        return self.maps.text_search_url(query, 'transit_station')
+
+    def search_places(self, url, top_n=None):
+        # Returns (places, details, cached). details is None when places are final, otherwise
+        # places are the uncached top n results and details their cached Place Details.
+        # cached tells whether the search itself came from GoogleMapsAPI.
+        # Concurrent searches for the same url share one lookup, so callers must copy
+        # the lists before changing them.
+        return self.search_flight.do((url, top_n), self._search_places, url, top_n)
+
+    def _search_places(self, url, top_n=None):
+        document = self.gmaps_cache.find_one(url)
+        if document is not None and 'response' in document:
+            return document['response'], None, True
+        if document is not None:
+            # Searched by the /maps/* passthrough, only the places are left to store
+            body, cached = document['raw'], True
+        else:
+            body, cached = self.maps.text_search(url).json(), False
+        raw = body if cacheable(body) and not cached else None
+        results = body.get('results', [])
+        if top_n is None:
+            self.save_places(url, results, raw=raw)
+            # In memory only, see refresh_search
+            self.spatial.add_many(results)
+            return results, None, cached
+        if raw is not None:
+            self.gmaps_cache.merge_one({'url': url, **response_fields(raw)})
+        results = get_top_n_places(top_n, results)
+        return results, self.lookup_place_details(results), cached
+
+    def save_places(self, url, places, top_n=None, raw=None):
+        # top_n marks searches stored with the Place Details of their top results. raw is the
+        # Google response served by the /maps/* passthrough, kept from earlier writes when missing.
+        document = {'url': url, 'response': places}
+        if top_n is not None:
+            document['top_n'] = top_n
+        if raw is not None:
+            document.update(response_fields(raw))
+        self.gmaps_cache.merge_one(document)
+
+    def text_search_response(self, url):
+        return self.maps_response(self.gmaps_cache, url, self.gmaps_cache.policy, lambda: self.maps.text_search(url).json())
+
+    def directions_response(self, origin, destination, params, mode, preference=None):
+        # Directions answer for the /maps/route/* endpoints, kept in RouteLegs under the quantized
+        # end points, the mode, the routing preference and the other params
+        origin, destination = leg_point(origin), leg_point(destination)
+        key = leg_key('directions', origin, destination, mode, preference, params)
+        request = {**params, 'origin': origin['directions'], 'destination': destination['directions']}
+        return self.maps_response(self.legs_cache, key, leg_policy(mode, preference), lambda: self.maps.directions(request).json(), {'directions': request})
+
+    def maps_response(self, cache, key, policy, fetch, fields=None):
+        # Google response of a /maps/* passthrough request, from cache under policy. Returns
+        # (body, document, policy, hit) where document has the etag and cached_at of the stored
+        # copy, or is None when the response was not cacheable, and hit is True when Google
+        # was not called.
+        return self.response_flight.do(key, self._maps_response, cache, key, policy, fetch, fields)
+
+    def _maps_response(self, cache, key, policy, fetch, fields):
+        document = cache.find_one(key, policy)
+        stored = stored_response(document)
+        if stored is not None:
+            return stored['raw'], stored, policy, True
+        body = fetch()
+        if not cacheable(body):
+            return body, None, policy, False
+        # A search stored with its place details keeps its age, the response only joins it
+        stored = cache.merge_one({cache.key_field: key, **(fields or {}), **response_fields(body)}, restamp=document is None)
+        return body, stored, policy, False
+
+    def route_legs(self, points, mode, preference=None):
+        # Every consecutive leg of points from the Routes API, as leg_summary dicts with a cached
+        # flag. Legs found in RouteLegs are answered at once, the misses are fetched together.
+        if len(points) - 1 > ROUTE_LEGS_MAX:
+            raise ValueError('At most {} legs per request'.format(ROUTE_LEGS_MAX))
+        points = [leg_point(point) for point in points]
+        policy = leg_policy(mode, preference)
+        legs = [(leg_key('routes', origin, destination, mode, preference), origin, destination) for origin, destination in zip(points, points[1:])]
+        found = self.legs_cache.find_many([key for key, _, _ in legs], policy)
+        pending = {}
+        for key, origin, destination in legs:
+            if key not in found and key not in pending:
+                pending[key] = submit(self.executor, self.fetch_leg, key, origin, destination, mode, preference)
+        summaries = []
+        try:
+            for key, _, _ in legs:
+                if key in found:
+                    summaries.append({**leg_summary(found[key]['raw']), 'cached': True})
+                else:
+                    try:
+                        summaries.append({**leg_summary(pending[key].result()), 'cached': False})
+                    except Exception as e:
+                        # Clients get a code, the exception names Google's host and path
+                        logger.warning('Route leg %s failed: %s', key, e)
+                        summaries.append({'error': 'UPSTREAM_ERROR', 'cached': False})
+        finally:
+            for future in pending.values():
+                future.cancel()
+        return summaries
+
+    def fetch_leg(self, key, origin, destination, mode, preference=None):
+        return self.leg_flight.do(key, self._fetch_leg, key, origin, destination, mode, preference)
+
+    def _fetch_leg(self, key, origin, destination, mode, preference=None):
+        payload = routes_payload(origin, destination, mode, preference)
+        body = self.maps.compute_routes(payload, LEG_FIELD_MASK).json()
+        if cacheable(body):
+            self.legs_cache.merge_one({'key': key, 'routes': payload, **response_fields(body)})
+        return body
+
+    def get_detailed_places(self, url):
+        places, details, _ = self.search_places(url, top_n=10)
+        if details is None:
+            return places
+        detailed_places = self.get_places_details(places, list(details))
+        self.save_places(url, detailed_places, 10)
+        return detailed_places
+
+    def get_restaurants(self, cuisines, cities):
+        return self.get_detailed_places(self.restaurants_url(cuisines, cities))
+
+    def get_tourist(self, neighborhood, cities):
+        return self.get_detailed_places(self.tourist_url(neighborhood, cities))
 
     def get_transit(self, cities):
+        return self.search_places(self.transit_url(cities))[0]
+
+    def clean_places(self, category, places):
+        if category == 'transit':
+            places = calculate_minmax_score(places[:10])
+        return clean_google_maps_data(category, places)
+
+    def iter_places(self, input):
+        # Runs the three text searches and their Place Details fan-outs together on
+        # self.executor and yields (category, places) as each category completes.
+        # Only the calling thread waits on futures, so a busy pool never has workers
+        # blocked on work queued behind them. Closing the generator cancels what is
+        # still queued.
+        tic = time.time()
+        searches = {
+            'restaurant': (self.restaurants_url(input['cuisine'], input['location']), 10),
+            'transit': (self.transit_url(input['location']), None),
+            'tourist': (self.tourist_url('', input['location']), 10),
+        }
+        pending = {}
+        for category, (url, top_n) in searches.items():
+            pending[submit(self.executor, self.search_places, url, top_n)] = (category, None)
+
+        details = {}
+        missing = {}
+        hits = {}
         try:
-            query = f"{cities}"
-            url = f"https://maps.googleapis.com/maps/api/place/textsearch/json?query={query}&type=transit_station&key={self.maps_api_key}"
-            
-            response_data = self.gmaps_collection.find_one({'url': url})
-            if response_data is None:
-                response = requests.get(url)
-                response_data = response.json()
-                response_data = response_data.get('results', [])
-                self.gmaps_collection.insert_one({'url': url, 'response': response_data})
-            else:
-                response_data = response_data['response']
-
-            return response_data
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    category, index = pending.pop(future)
+                    if index is None:
+                        results, cached, hits[category] = future.result()
+                        if cached is None:
+                            details[category] = results
+                        else:
+                            details[category] = list(cached)
+                            missing[category] = [i for i, place in enumerate(cached) if place is None]
+                            for i in missing[category]:
+                                pending[submit(self.executor, self.fetch_place_details, results[i])] = (category, i)
+                    else:
+                        details[category][index] = future.result()
+                    if any(place is None for place in details[category]):
+                        continue
+                    if category in missing:
+                        self.save_place_details([details[category][i] for i in missing[category]])
+                        self.save_places(searches[category][0], details[category], searches[category][1])
+                    log_event(logger, logging.DEBUG, 'Places fetched', category=category, places=len(details[category]), seconds=round(time.time() - tic, 2))
+                    hit = hits[category] and not missing.get(category)
+                    record('maps.' + category, time.time() - tic, 'hit' if hit else 'miss')
+                    yield category, self.clean_places(category, details[category])
+        finally:
+            for future in pending:
+                future.cancel()
+        log_event(logger, logging.INFO, 'Time to fetch places', seconds=round(time.time() - tic, 2))
+
+    def fetch_places(self, input):
+        return dict(self.iter_places(input))
@@ -1,94 +1,133 @@
 from .utils import *
-from .llm.agent import Agent
-from datetime import datetime, timedelta
+from .llm.agent import get_agent
+from .optimizer import optimize_itinerary
+from .hours import trip_weekdays
+from .places import to_public
+from .tracing import span, submit
+from .llm.compact import encode_places, encode_params, decode_itinerary
+from .constants import LLM_ORDER_DEADLINE, LLM_MAX_CONCURRENCY, COMPACT_PLACE_ENCODING
+import concurrent.futures
+import time
+import logging
+import numpy as np
+from .log import get_logger, log_event
+
+logger = get_logger('engine')
 
 secrets = load_secrets()
 
 class Engine(object):
-    def __init__(self) -> None:
+    def __init__(self, order_deadline=LLM_ORDER_DEADLINE, compact=COMPACT_PLACE_ENCODING, gemini_base_url=None) -> None:
         self.llm_api_key = secrets['GOOGLE_GEMINI_API_KEY']
-        self.agent = Agent(google_gemini_key=self.llm_api_key, debug=True)
-
-    def populate_day_time(self, places, params):
-    
-        duration = params['duration']
-
-        start_time = datetime.strptime("08:00", "%H:%M")
-        end_time = datetime.strptime("20:00", "%H:%M")
-    
-        total_time_minutes = int((end_time - start_time).total_seconds() / 60)
-        items = [item for item in places if item != 'prompt']
-        total_items = len(items)
-        items_per_day = total_items // duration
-        extra_items = total_items % duration
-
-        current_day = 1
-        current_time = start_time
-
-        for i, item in enumerate(items):
-            if 'day' not in item:
-                item['day'] = current_day
-            if 'time' not in item:
-                item['time'] = current_time.strftime("%H:%M")
-        
-            increment_minutes = total_time_minutes // items_per_day
-            current_time += timedelta(minutes=increment_minutes)
-
-        
-            if current_time >= end_time:
-                current_day += 1
-                current_time = start_time
-                if current_day > duration:
-                    current_day = duration  # Prevent going beyond the last day
-        
-        
-            if extra_items > 0:
-                if i < extra_items:
-                    item['day'] = current_day
-                    item['time'] = current_time.strftime("%H:%M")
-                    current_time += timedelta(minutes=increment_minutes)
-                    if current_time >= end_time:
-                        current_day += 1
-                        current_time = start_time
-                        if current_day > duration:
-                            current_day = duration  # Prevent going beyond the last day
-
-        return places
+        self.agent = get_agent(self.llm_api_key, base_url=gemini_base_url)
+        self.order_deadline = order_deadline
+        self.compact = compact
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY)
 
-    def order(self, places, params):
-        query = f'''
+    def populate_day_time(self, places, params, keep_days=False):
+        # keep_days keeps the day every place already has (e.g. from the LLM) and only
+        # reorders and re-times the stops within each day
+        return optimize_itinerary(places, params, keep_days=keep_days)
+
+    def insufficient(self, llm_output):
+        # Returns why an LLM itinerary cannot be used, None when it is fine
+        if len(llm_output) <= 3:
+            return 'too few places'
+        types = [p.get('type') for p in llm_output]
+        tourist = types.count('tourist')
+        if tourist == 0 or tourist + 2 < types.count('transit') or tourist + 2 < types.count('restaurant'):
+            return 'insufficient tourist places'
+        return None
+
+    def generate_trip(self, places, params):
+        if not self.compact:
+            places = to_public(places)
+            query = f'''
             {places}
             PARAMETER {params}
         '''
+            return self.agent.generate_trip(query)
+        table, ids = encode_places(places)
+        query = f'''
+{table}PARAMETER {encode_params(params)}
+        '''
+        return decode_itinerary(self.agent.generate_trip(query, compact=True), ids)
+
+    def order(self, places, params):
+        return self.order_with_source(places, params)[0]
+
+    def order_with_source(self, places, params, on_late_result=None):
+        with span('order'):
+            return self._order_with_source(places, params, on_late_result)
+
+    def _order_with_source(self, places, params, on_late_result=None):
+        # The LLM plan runs on self.executor while the deterministic plan is built here.
+        # Past the deadline the deterministic plan is returned right away, and a late but
+        # usable LLM plan is handed to on_late_result(places, ordering) when it arrives.
+        tic = time.time()
+        future = submit(self.executor, self.generate_trip, places, params)
         backup = sorted(places, key=lambda x: x['score'], reverse=True)
         modified_backup = backup[:duration_places_count(params['duration'])]
+        fallback = self.populate_day_time(modified_backup, params)
+
+        def ordering(source, reason):
+            info = {'source': source, 'reason': reason, 'deadline': self.order_deadline, 'seconds': round(time.time() - tic, 2)}
+            log_event(logger, logging.INFO, 'Ordering', **info)
+            return info
+
         try:
-            llm_output = self.agent.generate_trip(query)
-            if len(llm_output) <= 3:
-                print('BACKUP RECOMMENDATION')
-                return self.populate_day_time(modified_backup, params)
-            if len([p for p in llm_output if p['type'] == 'tourist']) == 0 or len([p for p in llm_output if p['type'] == 'tourist']) + 2 < len([p for p in llm_output if p['type'] == 'transit']) or len([p for p in llm_output if p['type'] == 'tourist']) + 2 < len([p for p in llm_output if p['type'] == 'restaurant']):
-                print("Insufficient tourist places.")
-                return self.populate_day_time(modified_backup, params)
-            return self.populate_day_time(llm_output, params)
+            llm_output = future.result(timeout=max(0, self.order_deadline - (time.time() - tic)))
+            reason = self.insufficient(llm_output)
+        except concurrent.futures.TimeoutError:
+            if on_late_result is not None:
+                # A future that finished meanwhile runs its callback right here, so the late
+                # result is always handed to the executor instead of the request thread. It is
+                # not submitted with the request's context, whose response is already sent.
+                future.add_done_callback(lambda f: self.executor.submit(self._late_result, f, params, tic, on_late_result))
+            return fallback, ordering('fallback', 'deadline')
         except Exception as e:
-            print('ERROR in recommenation engine:', e)
-            return self.populate_day_time(modified_backup, params)
+            logger.warning('LLM ordering failed: %s', e)
+            return fallback, ordering('fallback', 'error')
+        if reason is not None:
+            return fallback, ordering('fallback', reason)
+        return self.populate_day_time(llm_output, params, keep_days=True), ordering('llm', 'ok')
+
+    def _late_result(self, future, params, tic, on_late_result):
+        try:
+            llm_output = future.result()
+            if self.insufficient(llm_output) is not None:
+                return
+            ordering = {'source': 'llm', 'reason': 'late', 'deadline': self.order_deadline, 'seconds': round(time.time() - tic, 2)}
+            log_event(logger, logging.INFO, 'Late ordering', **ordering)
+            on_late_result(self.populate_day_time(llm_output, params, keep_days=True), ordering)
+        except Exception as e:
+            logger.warning('Late LLM ordering failed: %s', e)
 
     def filter(self, places, params):
-        filtered = filter_farther_places_and_flatten(int(params.get('distance')), places)
-        print('Filter based on distance:', len(filtered))
+        with span('filter'):
+            return self._filter(places, params)
+
+    def _filter(self, places, params):
+        # Every filter narrows one mask over the flattened candidates, only the places
+        # that pass all of them are collected at the end
+        candidates = places['tourist'] + places['restaurant'] + places['transit']
+        centroid = calculate_centroid(places['tourist'], places['transit'])
+        keep = within_radius_mask(*coordinates(candidates), centroid, int(params.get('distance')))
+        keep[:len(places['tourist'])] = True
+        counts = {'candidates': len(candidates), 'distance': int(keep.sum())}
 
-        filtered = filter_places_by_time(filtered, params.get('timings', '07:00-20:00'))
-        print('Filter based on timings:', len(filtered))
+        keep &= open_mask(candidates, params.get('timings', '07:00-20:00'), trip_weekdays(params))
+        counts['timings'] = int(keep.sum())
 
-        # filtered = [place for place in filtered if within_budget(params.get('budget', 'medium'), place['price_range'])]
-        # print('Filter based on budget:', len(filtered))
+        # keep &= np.fromiter((within_budget(params.get('budget', 'medium'), place['price_range']) for place in candidates), dtype=bool, count=len(candidates))
+        # counts['budget'] = int(keep.sum())
 
-        filtered = [place for place in filtered if place.get('score') is None or place.get('score') >= 0.3]
-        print('Filter based on score:', len(filtered))
+        scores = np.fromiter((1 if place.get('score') is None else place.get('score') for place in candidates), dtype=float, count=len(candidates))
+        keep &= scores >= 0.3
+        counts['score'] = int(keep.sum())
 
-        filtered = [place for place in filtered if place.get('business_status').lower() == 'operational']
-        print('Filter based on business status:', len(filtered))
+        keep &= np.fromiter((place.get('business_status').lower() == 'operational' for place in candidates), dtype=bool, count=len(candidates))
+        counts['business_status'] = int(keep.sum())
+        log_event(logger, logging.DEBUG, 'Places left after each filter', **counts)
 
-        return filtered
\ No newline at end of file
+        return [place for place, kept in zip(candidates, keep) if kept]
@@ -0,0 +1,156 @@
+import re
+import datetime
+import logging
+import threading
+from functools import lru_cache
+from unidecode import unidecode
+from .log import get_logger, log_event
+
+# Opening hours as minute intervals, one list per weekday in datetime.weekday() order.
+# An interval that runs past midnight keeps an end above 1440 on the day it opens.
+DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+MINUTES_PER_DAY = 24 * 60
+DEFAULT_INTERVALS = [[10 * 60, 18 * 60]]
+HOURS_CACHE_SIZE = 4096
+
+DAY_PREFIX = re.compile(r'^\s*([a-z]+)\s*:\s*', re.I)
+DASHES = re.compile(r'[\u2013\u2014\u2015]')
+SPACES = re.compile(r'\s+')
+RANGE = re.compile(r'\s*-\s*')
+
+logger = get_logger('hours')
+TIME = re.compile(r'^(\d{1,2})(?::?(\d{2}))?\s*(?:([ap])\.?m\.?)?$', re.I)
+ALWAYS_OPEN = {'open 24 hours', 'open 24h', '24 hours'}
+CLOSED = {'closed'}
+
+lock = threading.Lock()
+counters = {'parsed': 0, 'failures': 0}
+
+def count(name):
+    with lock:
+        counters[name] += 1
+
+def normalize(text):
+    # Same clean up as utils.clean_timing: ASCII dashes and single regular spaces
+    return SPACES.sub(' ', unidecode(DASHES.sub('-', text))).strip()
+
+def parse_time(text):
+    # Returns (minutes, meridiem), meridiem is None for a bare or 24 hour time
+    match = TIME.match(text)
+    if not match:
+        raise ValueError('unknown time {!r}'.format(text))
+    hour, minute = int(match.group(1)), int(match.group(2) or 0)
+    meridiem = match.group(3).lower() if match.group(3) else None
+    if minute > 59 or hour > 24 or (meridiem and not 1 <= hour <= 12):
+        raise ValueError('unknown time {!r}'.format(text))
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem == 'p' else 0)
+    return hour * 60 + minute, meridiem
+
+def parse_range(text):
+    parts = RANGE.split(text.strip())
+    if len(parts) != 2:
+        raise ValueError('unknown range {!r}'.format(text))
+    start, start_meridiem = parse_time(parts[0])
+    end, end_meridiem = parse_time(parts[1])
+    if start_meridiem is None and end_meridiem is not None and start < 12 * 60:
+        # "5:00 - 10:00 PM" shares the meridiem of its end, unless that would start after it
+        if end_meridiem == 'p' and start + 12 * 60 <= end:
+            start += 12 * 60
+    if end <= start:
+        end += MINUTES_PER_DAY
+    return [start, end]
+
+@lru_cache(maxsize=HOURS_CACHE_SIZE)
+def _parse_hours(text):
+    text = normalize(text)
+    if text.lower() in ALWAYS_OPEN:
+        return ((0, MINUTES_PER_DAY),)
+    if text.lower() in CLOSED:
+        return ()
+    return tuple(tuple(parse_range(part)) for part in text.split(',') if part.strip())
+
+def parse_hours(text):
+    # Minute intervals of one day's hours, e.g. "11:00 AM - 2:30 PM, 5:00 - 10:00 PM",
+    # None when the text cannot be parsed. Results are memoized per distinct text.
+    try:
+        intervals = _parse_hours(text)
+    except ValueError as e:
+        count('failures')
+        log_event(logger, logging.DEBUG, 'Unparsed opening hours', text=text, error=str(e))
+        return None
+    count('parsed')
+    return [list(interval) for interval in intervals]
+
+def parse_weekday_text(weekday_text):
+    # ["Monday: 9:00 AM - 5:00 PM", ...] -> 7 interval lists, None for unknown days
+    week = [None] * len(DAYS)
+    for line in weekday_text or []:
+        match = DAY_PREFIX.match(line)
+        day = match.group(1).lower() if match else None
+        if day not in DAYS:
+            count('failures')
+            continue
+        week[DAYS.index(day)] = parse_hours(line[match.end():])
+    return week
+
+def opening_intervals(place):
+    # Weekly intervals of a Place Details result, parsed when it is written to PlacesCache
+    if place.get('opening_intervals') is not None:
+        return place['opening_intervals']
+    return parse_weekday_text(place.get('current_opening_hours', {}).get('weekday_text', []))
+
+def intervals_on(week, weekday):
+    if not week or week[weekday] is None:
+        return DEFAULT_INTERVALS
+    return week[weekday]
+
+def overlaps(intervals, start, end):
+    return any(opens <= end and start <= closes for opens, closes in intervals)
+
+def slot_mask(start, end):
+    # One bit per minute of [start, end) within one day. A day's mask is a 1440 bit int, so
+    # the index answers exactly and a check is still a single AND.
+    start, end = max(0, start), min(MINUTES_PER_DAY, end)
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+def weekly_index(week):
+    # One slot bitmask per weekday, hours past midnight are carried into the next day
+    index = [0] * len(DAYS)
+    for weekday in range(len(DAYS)):
+        for start, end in intervals_on(week, weekday):
+            index[weekday] |= slot_mask(start, end)
+            if end > MINUTES_PER_DAY:
+                following = (weekday + 1) % len(DAYS)
+                index[following] |= slot_mask(0, end - MINUTES_PER_DAY)
+    return index
+
+def window_mask(start, end):
+    # Trip timings are inclusive of their end minute, like the old time comparison
+    return slot_mask(start, end + 1)
+
+def open_during(index, weekday, mask):
+    return bool(index[weekday] & mask)
+
+def trip_start(params):
+    # First day of the trip, params['start_date'] as YYYY-MM-DD, today when missing or invalid
+    value = params.get('start_date')
+    if value:
+        try:
+            return datetime.date.fromisoformat(str(value)[:10])
+        except ValueError:
+            log_event(logger, logging.INFO, 'Invalid start_date', value=value)
+    return datetime.date.today()
+
+def trip_weekdays(params):
+    # Weekday of every trip day, trip day n is trip_weekdays(params)[n - 1]
+    start = trip_start(params).weekday()
+    duration = max(1, int(params.get('duration') or 1))
+    return [(start + day) % len(DAYS) for day in range(duration)]
+
+def hours_stats():
+    info = _parse_hours.cache_info()
+    with lock:
+        return {**counters, 'memo_hits': info.hits, 'memo_misses': info.misses, 'memo_size': info.currsize}
@@ -0,0 +1,118 @@
+import pymongo
+from pymongo import IndexModel, ASCENDING, HASHED
+from .cache import utcnow
+from .constants import CACHE_POLICIES
+from .log import get_logger
+
+logger = get_logger('indexes')
+
+INDEX_OPTIONS_CONFLICT = 85
+
+def ttl_index(name):
+    # Mongo deletes cache documents once cached_at is older than the collection's expire
+    return IndexModel([('cached_at', ASCENDING)], name='cached_at_ttl', expireAfterSeconds=CACHE_POLICIES[name]['expire'])
+
+INDEXES = {
+    'GoogleMapsAPI': [IndexModel([('url', HASHED)], name='url_hashed'), ttl_index('GoogleMapsAPI')],
+    'PlacesCache': [
+        IndexModel([('place_id', ASCENDING)], name='place_id_unique', unique=True),
+        IndexModel([('cell', ASCENDING)], name='cell'),
+        ttl_index('PlacesCache'),
+    ],
+    'LLMCache': [IndexModel([('key', ASCENDING)], name='key_unique', unique=True, sparse=True), ttl_index('LLMCache')],
+    'RouteLegs': [IndexModel([('key', ASCENDING)], name='key_unique', unique=True), ttl_index('RouteLegs')],
+    'MagicLink': [IndexModel([('link', ASCENDING)], name='link_unique', unique=True)],
+}
+
+# Cache collections can lose duplicate documents to make a unique index possible, user data cannot
+DEDUPLICATE = {'PlacesCache', 'LLMCache', 'RouteLegs'}
+
+# One representative filter for every lookup the app runs, used to catch collection scans
+CACHE_QUERIES = {
+    'GoogleMapsAPI': [{'url': ''}],
+    'PlacesCache': [{'place_id': ''}, {'place_id': {'$in': ['']}}, {'cell': {'$in': ['']}}],
+    'LLMCache': [{'key': ''}],
+    'RouteLegs': [{'key': ''}, {'key': {'$in': ['']}}],
+    'MagicLink': [{'link': ''}],
+}
+
+def drop_duplicates(collection, field):
+    pipeline = [
+        {'$group': {'_id': f'${field}', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'_id': {'$ne': None}, 'count': {'$gt': 1}}},
+    ]
+    extra = [_id for group in collection.aggregate(pipeline, allowDiskUse=True) for _id in group['ids'][1:]]
+    if extra:
+        collection.delete_many({'_id': {'$in': extra}})
+    return len(extra)
+
+def stamp_legacy_documents(collection):
+    # Documents cached before cached_at existed would never expire, they start their lifetime now
+    return collection.update_many({'cached_at': {'$exists': False}}, {'$set': {'cached_at': utcnow()}}).modified_count
+
+def create_index(collection, index):
+    document = index.document
+    try:
+        collection.create_indexes([index])
+        return 'ok'
+    except pymongo.errors.OperationFailure as e:
+        if e.code == INDEX_OPTIONS_CONFLICT and 'expireAfterSeconds' in document:
+            # The TTL changed since the index was built, update it in place
+            collection.database.command('collMod', collection.name, index={'name': document['name'], 'expireAfterSeconds': document['expireAfterSeconds']})
+            return 'ok, expireAfterSeconds set to {}'.format(document['expireAfterSeconds'])
+        if not document.get('unique') or e.code != 11000:
+            raise
+        if collection.name in DEDUPLICATE:
+            removed = drop_duplicates(collection, next(iter(document['key'])))
+            collection.create_indexes([index])
+            return 'ok, removed {} duplicates'.format(removed)
+        fallback = IndexModel(list(document['key'].items()), name=document['name'].replace('_unique', '_lookup'))
+        collection.create_indexes([fallback])
+        return 'duplicates found, created non-unique {}'.format(fallback.document['name'])
+
+def uses_collection_scan(plan):
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(uses_collection_scan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(uses_collection_scan(value) for value in plan)
+    return False
+
+def provision_indexes(db):
+    report = {'indexes': {}, 'collection_scans': []}
+    for name, indexes in INDEXES.items():
+        collection = db.get_collection(name)
+        if name in CACHE_POLICIES:
+            try:
+                report['indexes'][f'{name}.legacy_documents'] = 'stamped {}'.format(stamp_legacy_documents(collection))
+            except pymongo.errors.PyMongoError as e:
+                report['indexes'][f'{name}.legacy_documents'] = 'failed: {}'.format(e)
+        for index in indexes:
+            index_name = index.document['name']
+            try:
+                report['indexes'][f'{name}.{index_name}'] = create_index(collection, index)
+            except pymongo.errors.PyMongoError as e:
+                report['indexes'][f'{name}.{index_name}'] = 'failed: {}'.format(e)
+        existing = collection.index_information()
+        for index in indexes:
+            index_name = index.document['name']
+            if index_name not in existing and not report['indexes'][f'{name}.{index_name}'].startswith(('failed', 'duplicates')):
+                report['indexes'][f'{name}.{index_name}'] = 'missing after creation'
+
+    for name, queries in CACHE_QUERIES.items():
+        collection = db.get_collection(name)
+        for query in queries:
+            try:
+                plan = collection.find(query).explain().get('queryPlanner', {})
+            except pymongo.errors.PyMongoError as e:
+                report['collection_scans'].append({'collection': name, 'query': str(query), 'error': str(e)})
+                continue
+            if uses_collection_scan(plan):
+                report['collection_scans'].append({'collection': name, 'query': str(query)})
+
+    for index, status in report['indexes'].items():
+        logger.info('Index %s: %s', index, status)
+    for scan in report['collection_scans']:
+        logger.warning('Collection scan on %s: %s', scan['collection'], scan['query'])
+    return report
@@ -0,0 +1,92 @@
+import json
+from .constants import ROUTE_LEG_PRECISION, ROUTE_LEG_POLICIES
+
+# Route legs are cached by their end points, travel mode and routing preference. An end point
+# is named by its place id when it has one, else by its coordinates rounded to
+# ROUTE_LEG_PRECISION decimals (4 is about 11 m), else by its normalized address. The request
+# sent to Google uses the same rounded point, so a cached answer is the answer for its key.
+
+MODES = {'DRIVING': 'DRIVE', 'WALKING': 'WALK', 'BICYCLING': 'BICYCLE', 'BIKING': 'BICYCLE'}
+TRAFFIC_MODES = ('DRIVE', 'TWO_WHEELER')
+TRAFFIC_PREFERENCES = ('TRAFFIC_AWARE', 'TRAFFIC_AWARE_OPTIMAL')
+# Fields of a Routes API answer kept for a leg
+LEG_FIELD_MASK = 'routes.duration,routes.distanceMeters,routes.polyline.encodedPolyline'
+
+def normalize_mode(mode):
+    mode = str(mode or 'DRIVE').strip().upper()
+    return MODES.get(mode, mode)
+
+def traffic_class(mode, preference=None):
+    # How quickly a leg's answer changes: with traffic, with transit schedules, or hardly at all
+    mode = normalize_mode(mode)
+    if mode == 'TRANSIT':
+        return 'schedule'
+    if mode in TRAFFIC_MODES and str(preference or '').upper() in TRAFFIC_PREFERENCES:
+        return 'traffic'
+    return 'static'
+
+def routing_preference(mode, preference=None):
+    # The preference a request carries, only driving legs take one and the Routes API rejects
+    # it for the other modes
+    if preference and normalize_mode(mode) in TRAFFIC_MODES:
+        return str(preference).upper()
+    return None
+
+def leg_policy(mode, preference=None):
+    return ROUTE_LEG_POLICIES[traffic_class(mode, preference)]
+
+def point_coordinates(point):
+    lat_lng = point.get('location', {}).get('latLng') if isinstance(point.get('location'), dict) else None
+    if lat_lng:
+        return lat_lng.get('latitude'), lat_lng.get('longitude')
+    if point.get('latitude') is not None:
+        return point.get('latitude'), point.get('longitude')
+    return point.get('lat'), point.get('lng')
+
+def leg_point(point, precision=ROUTE_LEG_PRECISION):
+    # Accepts Routes API waypoints ({'placeId'}, {'location': {'latLng'}}, {'address'}), plan
+    # places ({'id', 'latitude', 'longitude'}) and plain addresses. Returns the point's cache key
+    # with its Directions and Routes API forms.
+    if isinstance(point, str):
+        point = {'address': point}
+    place_id = point.get('placeId') or point.get('place_id') or point.get('id')
+    if place_id:
+        return {'key': 'place:' + place_id, 'directions': 'place_id:' + place_id, 'routes': {'placeId': place_id}}
+    lat, lng = point_coordinates(point)
+    if lat is not None and lng is not None:
+        lat, lng = round(float(lat), precision), round(float(lng), precision)
+        return {
+            'key': 'll:{:.{p}f},{:.{p}f}'.format(lat, lng, p=precision),
+            'directions': '{:.{p}f},{:.{p}f}'.format(lat, lng, p=precision),
+            'routes': {'location': {'latLng': {'latitude': lat, 'longitude': lng}}},
+        }
+    address = ' '.join(str(point.get('address') or '').split())
+    return {'key': 'address:' + address.lower(), 'directions': address, 'routes': {'address': address}}
+
+def leg_key(api, origin, destination, mode, preference=None, options=None):
+    # options are the other request parameters that change the answer, e.g. alternatives
+    parts = [api, origin['key'], destination['key'], normalize_mode(mode), routing_preference(mode, preference) or '']
+    if options:
+        parts.append(json.dumps(options, sort_keys=True, separators=(',', ':'), default=str))
+    return '|'.join(parts)
+
+def routes_payload(origin, destination, mode, preference=None):
+    payload = {'origin': origin['routes'], 'destination': destination['routes'], 'travelMode': normalize_mode(mode)}
+    preference = routing_preference(mode, preference)
+    if preference:
+        payload['routingPreference'] = preference
+    return payload
+
+def leg_summary(body):
+    # Distance, duration and polyline of the first route of a Routes API answer
+    if not isinstance(body, dict) or 'error' in body:
+        error = body.get('error') if isinstance(body, dict) else None
+        return {'error': error.get('status', 'ROUTES_ERROR') if isinstance(error, dict) else 'ROUTES_ERROR'}
+    routes = body.get('routes') or []
+    if not routes:
+        return {'error': 'NO_ROUTE'}
+    return {
+        'distanceMeters': routes[0].get('distanceMeters'),
+        'duration': routes[0].get('duration'),
+        'polyline': routes[0].get('polyline', {}).get('encodedPolyline'),
+    }
@@ -8,7 +8,7 @@ class MagicLink(object):
     website_domain = load_secrets()['WEBSITE_DOMAIN']
     mongo_client = pymongo.MongoClient(mongo_connection_string)
     mongo_db = mongo_client.get_database('TripTonicDump')
-    mongo_collection = pymongo.collection.Collection(mongo_db, 'MagicLink')
+    mongo_collection = mongo_db.get_collection('MagicLink')
 
     @staticmethod
     def generate_link():
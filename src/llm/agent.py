@@ -1,19 +1,27 @@
 import json
 from langchain.chains import LLMChain, SequentialChain
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
 from langchain_google_genai import GoogleGenerativeAI
 from .templates import (
     FilterAndOrderingTemplate,
+    CompactOrderingTemplate,
     ValidationTemplate,
-    ExtractParametersTemplate
+    ExtractParametersTemplate,
+    ValidateAndExtractTemplate
 )
+from ..constants import SINGLE_CALL_EXTRACTION
+from ..tracing import span
+from ..log import get_logger, log_payload
 
 import logging
+import threading
 import time
 
-logging.basicConfig(level=logging.INFO)
+logger = get_logger('llm.agent')
 
 def enrich_params(params):
-    print('Enriching params:', params)
+    log_payload(logger, 'Enriching params', params)
     if params.get('origin') is None:
         params['origin'] = params['location'].split(', ')[0]
     if params.get('timings', '') == '':
@@ -52,9 +60,38 @@ def enrich_params(params):
         if params.get('no_of_people') <= 4:
             params['mode_of_transport'] = 'TRANSIT'
     
-    print('Enriched params:', params)
+    log_payload(logger, 'Enriched params', params)
     return params
 
+class ChainLogger(BaseCallbackHandler):
+    def __init__(self, logger):
+        self.logger = logger
+
+    def on_chain_start(self, serialized, inputs, **kwargs):
+        log_payload(self.logger, 'Chain start', inputs, chain=(serialized or {}).get('id', ['chain'])[-1])
+
+    def on_chain_end(self, outputs, **kwargs):
+        log_payload(self.logger, 'Chain end', outputs)
+
+    def on_chain_error(self, error, **kwargs):
+        self.logger.warning('Chain failed: %s', error)
+
+_agents = {}
+_agents_lock = threading.Lock()
+
+def get_agent(google_gemini_key, model='gemini-1.0-pro-latest', temperature=0, debug=True, base_url=None):
+    # Agents are stateless between calls, so one per process shares the Gemini client,
+    # its connection and the prompt/parser/chain objects across every request thread.
+    key = (google_gemini_key, model, temperature, debug, base_url)
+    agent = _agents.get(key)
+    if agent is None:
+        with _agents_lock:
+            agent = _agents.get(key)
+            if agent is None:
+                agent = Agent(google_gemini_key=google_gemini_key, model=model, temperature=temperature, debug=debug, base_url=base_url)
+                _agents[key] = agent
+    return agent
+
 class Agent(object):
     def __init__(
         self,
@@ -62,30 +99,43 @@ class Agent(object):
         model= 'gemini-1.0-pro-latest',
         temperature=0,
         debug=True,
+        single_call=SINGLE_CALL_EXTRACTION,
+        base_url=None,
     ):
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.INFO)
+        self.logger = logger
+        # Chain inputs and outputs go to the DEBUG log instead of LangChain's verbose stdout
+        self.callbacks = [ChainLogger(logger)] if debug else []
         self._openai_key = google_gemini_key
 
-        self.chat_model = GoogleGenerativeAI(model=model, temperature=temperature, google_api_key=self._openai_key)
+        if base_url:
+            # Local generateContent stand-in, only reachable over REST
+            self.chat_model = GoogleGenerativeAI(model=model, temperature=temperature, google_api_key=self._openai_key,
+                                                 transport='rest', client_options={'api_endpoint': base_url})
+        else:
+            self.chat_model = GoogleGenerativeAI(model=model, temperature=temperature, google_api_key=self._openai_key)
         self.validation_prompt = ValidationTemplate()
         self.extract_parameters_prompt = ExtractParametersTemplate()
         self.generate_trip_prompt = FilterAndOrderingTemplate()
+        self.generate_compact_trip_prompt = CompactOrderingTemplate()
+        self.validate_and_extract_prompt = ValidateAndExtractTemplate()
+        self.single_call = single_call
         self.validation_chain = self._set_up_validation_chain(debug)
+        self.validate_and_extract_chain = self._set_up_validate_and_extract_chain(debug)
         self.generate_trip_chain = self._set_up_generate_trip_chain(debug)
+        self.generate_compact_trip_chain = self._set_up_generate_trip_chain(debug, self.generate_compact_trip_prompt)
 
-    def _set_up_generate_trip_chain(self, debug=True):
+    def _set_up_generate_trip_chain(self, debug=True, template=None):
         travel_agent = LLMChain(
             llm=self.chat_model,
-            prompt=self.generate_trip_prompt.chat_prompt,
-            verbose=debug,
+            prompt=(template or self.generate_trip_prompt).chat_prompt,
+            callbacks=self.callbacks,
             output_key="agent_suggestion",
         )
         overall_chain = SequentialChain(
             chains=[travel_agent],
             input_variables=["query"],
             output_variables=["agent_suggestion"],
-            verbose=debug,
+            callbacks=self.callbacks,
         )
 
         return overall_chain        
@@ -98,13 +148,13 @@ class Agent(object):
             prompt=self.validation_prompt.chat_prompt,
             output_parser=self.validation_prompt.parser,
             output_key="validation_output",
-            verbose=debug,
+            callbacks=self.callbacks,
         )
 
         travel_agent = LLMChain(
             llm=self.chat_model,
             prompt=self.extract_parameters_prompt.chat_prompt,
-            verbose=debug,
+            callbacks=self.callbacks,
             output_key="agent_suggestion",
         )
         
@@ -113,35 +163,45 @@ class Agent(object):
             chains=[validation_agent, travel_agent],
             input_variables=["query", "format_instructions"],
             output_variables=["validation_output","agent_suggestion"],
-            verbose=debug,
+            callbacks=self.callbacks,
         )
 
         return overall_chain
 
-    def generate_trip(self, query):
+    def _set_up_validate_and_extract_chain(self, debug=True):
+        return LLMChain(
+            llm=self.chat_model,
+            prompt=self.validate_and_extract_prompt.chat_prompt,
+            output_parser=self.validate_and_extract_prompt.parser,
+            output_key="trip_request",
+            callbacks=self.callbacks,
+        )
+
+    def generate_trip(self, query, compact=False):
+        # compact expects the CSV place table of llm.compact and answers with [{"id", "day", "time"}]
         t1 = time.time()
         self.logger.info(
             "Calling Generate Trip (model is {}) on user input".format(
                 self.chat_model.model
             )
         )
-        response = self.generate_trip_chain(
-            {
-                "query": query,
-            }
-        )
+        chain = self.generate_compact_trip_chain if compact else self.generate_trip_chain
+        with span('llm_ordering'):
+            response = chain(
+                {
+                    "query": query,
+                }
+            )
         trip = response["agent_suggestion"]
-        print('### START')
         trip = trip.strip().replace("'", '"')
-        print(trip)
-        print('### END')
+        log_payload(self.logger, 'Generated trip', trip)
         t2 = time.time()
         output = json.loads(trip)
         self.logger.info("Time to generate trip request: {}".format(round(t2 - t1, 2)))
 
         return output
 
-    def validate_travel(self, query):
+    def validate_travel(self, query, single_call=None):
         self.logger.info("Validating query")
         t1 = time.time()
         self.logger.info(
@@ -149,22 +209,51 @@ class Agent(object):
                 self.chat_model.model
             )
         )
-        validation_result = self.validation_chain(
+        output = None
+        single_call = self.single_call if single_call is None else single_call
+        if single_call:
+            try:
+                with span('llm_validation_extraction'):
+                    output = self._validate_and_extract(query)
+            except OutputParserException as e:
+                self.logger.info("Single call validation failed to parse, falling back to two calls: {}".format(e))
+        if output is None:
+            output = self._validate_then_extract(query)
+        output = enrich_params(output)
+
+        t2 = time.time()
+        self.logger.info("Time to validate request: {}".format(round(t2 - t1, 2)))
+
+        return output
+
+    def _validate_and_extract(self, query):
+        result = self.validate_and_extract_chain(
             {
                 "query": query,
-                "format_instructions": self.validation_prompt.parser.get_format_instructions(),
+                "format_instructions": self.validate_and_extract_prompt.parser.get_format_instructions(),
             }
         )
-        is_request_valid = validation_result['validation_output'].plan_is_valid
-        print('Validation object:', validation_result['validation_output'])
+        trip_request = result["trip_request"]
+        log_payload(self.logger, 'Validation object', trip_request.model_dump())
+        if trip_request.plan_is_valid.strip().lower() in ('no', '0'):
+            raise ValueError('UNREASONABLE_REQUEST')
+        return trip_request.model_dump(exclude_none=True, exclude={'plan_is_valid'})
+
+    def _validate_then_extract(self, query):
+        # The validation chain's two steps run one by one, so each gets its own span and
+        # invalid requests skip the extraction call
+        validation_agent, extraction_agent = self.validation_chain.chains
+        inputs = {
+            "query": query,
+            "format_instructions": self.validation_prompt.parser.get_format_instructions(),
+        }
+        with span('llm_validation'):
+            validation_output = validation_agent(inputs)['validation_output']
+        is_request_valid = validation_output.plan_is_valid
+        log_payload(self.logger, 'Validation object', validation_output.model_dump())
         if is_request_valid == 'no':
             raise ValueError('UNREASONABLE_REQUEST')
-        
-        validation_test = validation_result["agent_suggestion"]
-        output = json.loads(validation_test.strip())
-        output = enrich_params(output)
-            
-        t2 = time.time()
-        self.logger.info("Time to validate request: {}".format(round(t2 - t1, 2)))
 
-        return output
+        with span('llm_extraction'):
+            validation_test = extraction_agent(inputs)["agent_suggestion"]
+        return json.loads(validation_test.strip())
@@ -0,0 +1,50 @@
+import copy
+import csv
+import io
+import json
+
+# Columns the ordering prompt needs, everything else stays on the server
+COLUMNS = ('id', 'type', 'name', 'rating', 'reviews', 'price', 'hours', 'lat', 'lng', 'description')
+DESCRIPTION_LENGTH = 120
+PARAMETERS = ('location', 'origin', 'duration', 'no_of_people', 'budget', 'mode_of_transport', 'type_of_trip', 'cuisine', 'attractions', 'timings')
+
+def encode_places(places):
+    # Returns a CSV table of the places keyed by short ids, and the id -> place lookup
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    ids = {}
+    for i, place in enumerate(places):
+        short_id = 'p{}'.format(i)
+        ids[short_id] = place
+        writer.writerow([
+            short_id,
+            place.get('type', ''),
+            place.get('name', ''),
+            place.get('rating', ''),
+            place.get('total_reviews', ''),
+            place.get('price_range', ''),
+            place.get('todays_working_hours', ''),
+            round(place.get('latitude', 0), 3),
+            round(place.get('longitude', 0), 3),
+            (place.get('description') or '')[:DESCRIPTION_LENGTH],
+        ])
+    return buffer.getvalue(), ids
+
+def encode_params(params):
+    return json.dumps({key: params[key] for key in PARAMETERS if key in params}, separators=(',', ':'))
+
+def decode_itinerary(llm_output, ids):
+    # Rebuilds full places from the [{"id", "day", "time"}] answer, unknown and repeated ids are dropped
+    places = []
+    seen = set()
+    for item in llm_output:
+        short_id = str(item.get('id', '')).strip()
+        if short_id not in ids or short_id in seen:
+            continue
+        seen.add(short_id)
+        place = copy.copy(ids[short_id])
+        place['day'] = item.get('day', 1)
+        place['time'] = item.get('time', '')
+        places.append(place)
+    return places
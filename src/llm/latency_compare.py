@@ -0,0 +1,54 @@
+import sys
+import os
+import time
+import numpy as np
+
+# Add the parent directory of 'src' to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from src.utils import load_secrets
+from src.llm.agent import Agent
+
+PROMPTS = [
+    "Plan a family trip to San Diego from Irvine for 2 days covering historical places with Italian cuisine. For a family of five with a tight budget and daily travel from 6 AM to 5 PM.",
+    "Weekend in Chicago with friends, we love deep dish pizza, museums and jazz clubs.",
+    "Three day couples trip to San Francisco and Napa, medium budget, we want sushi and wine tasting.",
+    "One day in Los Angeles for two people who like Mexican food and parks, travelling by transit.",
+    "Take me on a four day road trip from Seattle to Portland for seven friends who love Korean barbecue.",
+    "Fly me to the moon",
+]
+ROUNDS = 3
+
+def run(agent, single_call):
+    latencies = []
+    outputs = {}
+    for _ in range(ROUNDS):
+        for prompt in PROMPTS:
+            tic = time.time()
+            try:
+                outputs[prompt] = agent.validate_travel(prompt, single_call=single_call)
+            except ValueError as e:
+                outputs[prompt] = str(e)
+            latencies.append(time.time() - tic)
+    return np.array(latencies), outputs
+
+def summary(latencies):
+    return 'mean {:.2f}s p50 {:.2f}s p95 {:.2f}s'.format(
+        latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 95)
+    )
+
+if __name__ == '__main__':
+    secrets = load_secrets()
+    travel_agent = Agent(google_gemini_key=secrets['GOOGLE_GEMINI_API_KEY'], debug=False)
+
+    two_call_latencies, two_call_outputs = run(travel_agent, single_call=False)
+    single_call_latencies, single_call_outputs = run(travel_agent, single_call=True)
+
+    print('Two calls  :', summary(two_call_latencies))
+    print('Single call:', summary(single_call_latencies))
+    for prompt in PROMPTS:
+        same = two_call_outputs[prompt] == single_call_outputs[prompt]
+        print('{} {}'.format('same' if same else 'DIFF', prompt[:60]))
+        if not same:
+            print('  two calls  :', two_call_outputs[prompt])
+            print('  single call:', single_call_outputs[prompt])
@@ -0,0 +1,79 @@
+import sys
+import os
+import time
+import numpy as np
+
+# Add the parent directory of 'src' to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from src.utils import load_secrets
+from src.llm.agent import Agent
+from src.llm.compact import encode_places, encode_params, decode_itinerary
+
+PARAMS = {
+    'location': 'chicago', 'origin': 'chicago', 'duration': 2, 'no_of_people': 4, 'budget': 'medium',
+    'mode_of_transport': 'TRANSIT', 'type_of_trip': 'family', 'cuisine': 'italian|pizza',
+    'attractions': 'museum', 'timings': '09:00-20:00',
+}
+NAMES = {
+    'restaurant': ['La Scarola', 'Lou Malnatis', 'Giordanos', 'Pequods Pizza', 'Gibsons Italia', 'Monteverde'],
+    'tourist': ['Art Institute of Chicago', 'Millennium Park', 'Navy Pier', 'Field Museum', 'Shedd Aquarium', 'Lincoln Park Zoo', 'Museum of Science and Industry', 'Willis Tower Skydeck'],
+    'transit': ['Union Station', 'Clark/Lake', 'Jackson'],
+}
+ROUNDS = 3
+
+def sample_places():
+    places = []
+    for place_type, names in NAMES.items():
+        for i, name in enumerate(names):
+            places.append({
+                'name': name,
+                'type': place_type,
+                'place_id': 'ChIJ{:028d}'.format(len(places)),
+                'address': '{} W Example St, Chicago, IL 606{:02d}, USA'.format(100 + i, i),
+                'latitude': 41.85 + 0.01 * i,
+                'longitude': -87.65 + 0.008 * len(places),
+                'rating': 4.5,
+                'total_reviews': 1000 + 250 * i,
+                'price_range': 2,
+                'business_status': 'OPERATIONAL',
+                'todays_working_hours': '10:00 AM - 08:00 PM',
+                'score': 0.8,
+                'description': 'Popular {} in downtown Chicago, well known among visitors and locals alike for its atmosphere.'.format(place_type),
+                'url': 'https://maps.google.com/?cid={}'.format(1000000 + len(places)),
+            })
+    return places
+
+def run(agent, places, compact):
+    if compact:
+        table, ids = encode_places(places)
+        query = '\n{}PARAMETER {}\n'.format(table, encode_params(PARAMS))
+    else:
+        query = '\n{}\nPARAMETER {}\n'.format(places, PARAMS)
+    latencies = []
+    output = []
+    for _ in range(ROUNDS):
+        tic = time.time()
+        output = agent.generate_trip(query, compact=compact)
+        latencies.append(time.time() - tic)
+    if compact:
+        output = decode_itinerary(output, ids)
+    return query, np.array(latencies), output
+
+def summary(agent, query, latencies):
+    return 'chars {} tokens {} mean {:.2f}s p50 {:.2f}s'.format(
+        len(query), agent.chat_model.get_num_tokens(query), latencies.mean(), np.percentile(latencies, 50)
+    )
+
+if __name__ == '__main__':
+    secrets = load_secrets()
+    travel_agent = Agent(google_gemini_key=secrets['GOOGLE_GEMINI_API_KEY'], debug=False)
+    places = sample_places()
+
+    full_query, full_latencies, full_output = run(travel_agent, places, compact=False)
+    compact_query, compact_latencies, compact_output = run(travel_agent, places, compact=True)
+
+    print('Full places:', summary(travel_agent, full_query, full_latencies))
+    print('Compact    :', summary(travel_agent, compact_query, compact_latencies))
+    for label, output in (('Full places', full_output), ('Compact    ', compact_output)):
+        print('{} itinerary: {}'.format(label, [(place.get('day'), place.get('time'), place.get('name')) for place in output]))
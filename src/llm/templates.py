@@ -4,6 +4,7 @@ from langchain.prompts.chat import (
     HumanMessagePromptTemplate,
 )
 from langchain.output_parsers import PydanticOutputParser
+from typing import Optional
 from pydantic import BaseModel, Field
 
 class Validation(BaseModel):
@@ -52,14 +53,7 @@ class ValidationTemplate(object):
             [self.system_message_prompt, self.human_message_prompt]
         )
 
-class ExtractParametersTemplate(object):
-    def __init__(self):
-        self.system_template = """
-            You are a travel agent who helps users make exciting travel plans.
-
-            The user's request will be denoted by four hashtags. This request should be valid.
-
-            A valid request should contain the following:
+EXTRACTION_RULES = """            A valid request should contain the following:
             - Few locations the user want to visit, should mention at least one
             - If origin as in the start of the location is not provided by the user, consider one of the location(s) of the trip as the origin. It should be a single location only.
             - A trip duration that is reasonable given the location(s), can be number of days
@@ -135,6 +129,15 @@ class ExtractParametersTemplate(object):
             Also consider contextual cues like "reading manga" to be japanese cuisine and stuff like that.
         """
 
+class ExtractParametersTemplate(object):
+    def __init__(self):
+        self.system_template = """
+            You are a travel agent who helps users make exciting travel plans.
+
+            The user's request will be denoted by four hashtags. This request should be valid.
+
+""" + EXTRACTION_RULES
+
         self.human_template = """
             ####{query}####
         """
@@ -150,6 +153,58 @@ class ExtractParametersTemplate(object):
             [self.system_message_prompt, self.human_message_prompt]
         )
 
+class TripRequest(BaseModel):
+    plan_is_valid: str = Field(
+        description="This field is 'yes' if the plan is feasible, 'no' otherwise"
+    )
+    location: Optional[str] = Field(default=None, description="Locations of the trip separated by comma")
+    origin: Optional[str] = Field(default=None, description="Single starting location of the trip")
+    duration: Optional[int] = Field(default=None, description="Trip duration in days")
+    no_of_people: Optional[int] = Field(default=None, description="Number of people on the trip")
+    budget: Optional[str] = Field(default=None, description="One of low, medium, high")
+    mode_of_transport: Optional[str] = Field(default=None, description="One of DRIVING, BICYCLING, WALKING, TRANSIT")
+    type_of_trip: Optional[str] = Field(default=None, description="One of family, friends, couple")
+    cuisine: Optional[str] = Field(default=None, description="Cuisines separated by comma")
+    timings: Optional[str] = Field(default=None, description="Daily time range in HH:MM-HH:MM 24Hr format")
+    attractions: Optional[str] = Field(default=None, description="Attractions like park, museum, club")
+    distance: Optional[int] = Field(default=None, description="Travel radius in miles")
+
+class ValidateAndExtractTemplate(object):
+    def __init__(self):
+        self.system_template = """
+            You are a travel agent who helps users make exciting travel plans.
+
+            The user's request will be denoted by four hashtags. First determine if the user's
+            request is reasonable and achievable within the constraints they set.
+            Set plan_is_valid = "no" for requests not pertaining to travel and for unreasonable
+            requests like "Fly me to the moon" or "I want to walk from India to USA", otherwise set plan_is_valid = "yes".
+
+            When the request is valid, also extract the trip parameters in the same JSON object.
+
+""" + EXTRACTION_RULES + """
+            {format_instructions}
+        """
+
+        self.human_template = """
+            ####{query}####
+        """
+
+        self.parser = PydanticOutputParser(pydantic_object=TripRequest)
+
+        self.system_message_prompt = SystemMessagePromptTemplate.from_template(
+            self.system_template,
+            partial_variables={
+                "format_instructions": self.parser.get_format_instructions()
+            },
+        )
+        self.human_message_prompt = HumanMessagePromptTemplate.from_template(
+            self.human_template, input_variables=["query"]
+        )
+
+        self.chat_prompt = ChatPromptTemplate.from_messages(
+            [self.system_message_prompt, self.human_message_prompt]
+        )
+
 class FilterAndOrderingTemplate(object):
     def __init__(self):
         self.system_template = """
@@ -224,3 +279,53 @@ class FilterAndOrderingTemplate(object):
         self.chat_prompt = ChatPromptTemplate.from_messages(
             [self.system_message_prompt, self.human_message_prompt]
         )
+
+class CompactOrderingTemplate(object):
+    def __init__(self):
+        self.system_template = """
+            You are a travel agent who helps users make exciting travel plans.
+
+            The user's request will be denoted by four hashtags. It has a CSV table of candidate places
+            (id,type,name,rating,reviews,price,hours,lat,lng,description) and a PARAMETER object.
+            Select and order places into the perfect itinerary.
+
+            Selection rules:
+            - Number of places by "duration": one day 5, two days 9, three days 12 and so on.
+            - At least 2 "tourist" places per day and at least 1 "transit" place in the trip.
+            - No more than 5 places per day and no 2 places at the same time of the day.
+            - Use lat/lng to keep each day's places close together, closer for WALKING/BIKING, near transit for TRANSIT.
+            - Match the description with "attractions" and "type_of_trip", and price with the budget.
+            - Visit places within their hours and within the "timings" of the trip.
+
+            Answer with a minified JSON list only, one object per selected place with its id, day (a number
+            from 1 to duration) and time (24 hour HH:MM), ordered by day and time. Use double quotes.
+
+            For example:
+            ####
+            id,type,name,rating,reviews,price,hours,lat,lng,description
+            p0,restaurant,La Scarola,4.7,1687,2,4:00 AM - 10:00 PM,41.891,-87.647,Cozy spot serving classic Italian comfort food.
+            p1,transit,Union Station,4.2,77,2,10:00 AM - 06:00 PM,41.879,-87.64,
+            p2,tourist,Art Institute of Chicago,4.8,30510,2,10:30 AM - 05:00 PM,41.88,-87.624,World-famous art museum.
+            p3,tourist,Millennium Park,4.8,74320,2,6:00 AM - 11:00 PM,41.883,-87.623,Park with the Cloud Gate sculpture.
+            p4,tourist,Navy Pier,4.5,101254,2,10:00 AM - 09:00 PM,41.892,-87.605,Lakefront pier with rides and dining.
+            PARAMETER {{"location":"chicago","duration":1,"mode_of_transport":"TRANSIT","attractions":"museum","timings":"09:00-20:00"}}
+            #####
+
+            Output:
+            [{{"id":"p1","day":1,"time":"09:00"}},{{"id":"p2","day":1,"time":"10:30"}},{{"id":"p3","day":1,"time":"13:00"}},{{"id":"p0","day":1,"time":"15:00"}},{{"id":"p4","day":1,"time":"17:00"}}]
+        """
+
+        self.human_template = """
+            ####{query}####
+        """
+
+        self.system_message_prompt = SystemMessagePromptTemplate.from_template(
+            self.system_template,
+        )
+        self.human_message_prompt = HumanMessagePromptTemplate.from_template(
+            self.human_template, input_variables=["query"]
+        )
+
+        self.chat_prompt = ChatPromptTemplate.from_messages(
+            [self.system_message_prompt, self.human_message_prompt]
+        )
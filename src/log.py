@@ -0,0 +1,116 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from .constants import LOG_PROFILE, LOG_PROFILES, LOG_QUEUE_SIZE
+
+# Structured logging for the app. Records carry their fields in record.fields, callers only
+# put them on a queue and one listener thread formats and writes them, so a slow stdout never
+# holds up a request. Large payloads (Maps responses, LLM output, chain inputs) are logged as
+# a summary, the payload itself only at DEBUG and for a sampled share of the calls.
+
+ROOT = 'triptonic'
+SETTINGS = dict(LOG_PROFILES[LOG_PROFILE])
+_setup_lock = threading.Lock()
+_listener = {}
+
+def get_logger(name):
+    return logging.getLogger('{}.{}'.format(ROOT, name))
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Drops records when the listener falls behind instead of blocking the caller
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join('{}={}'.format(key, value) for key, value in fields.items())
+        return text
+
+FORMATTERS = {'json': JsonFormatter, 'text': TextFormatter}
+
+def setup_logging(profile=None, stream=None):
+    # Sends the app loggers through the queue, once per process. profile is a key of LOG_PROFILES.
+    with _setup_lock:
+        if _listener:
+            return _listener['handler']
+        SETTINGS.update(LOG_PROFILES[profile or LOG_PROFILE])
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(FORMATTERS[SETTINGS['format']]())
+        handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        listener = logging.handlers.QueueListener(handler.queue, output)
+        listener.start()
+        atexit.register(listener.stop)
+
+        logger = logging.getLogger(ROOT)
+        logger.setLevel(SETTINGS['level'])
+        logger.addHandler(handler)
+        logger.propagate = False
+        _listener.update(handler=handler, listener=listener)
+        return handler
+
+def log_event(logger, level, message, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={'fields': fields})
+
+def summarize(payload):
+    # A few cheap facts about a payload: its type, size and the sizes of its lists
+    if isinstance(payload, dict):
+        summary = {'keys': len(payload)}
+        for key, value in payload.items():
+            if isinstance(value, (list, tuple)):
+                summary[key] = len(value)
+            elif key == 'status' and isinstance(value, str):
+                summary[key] = value
+        return summary
+    if isinstance(payload, (list, tuple)):
+        return {'items': len(payload)}
+    if isinstance(payload, (str, bytes)):
+        return {'chars': len(payload)}
+    return {'type': type(payload).__name__}
+
+def sampled():
+    rate = SETTINGS['payload_sample_rate']
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+def log_payload(logger, message, payload, level=logging.DEBUG, **fields):
+    # Logs the summary of payload, the payload itself (cut to payload_max_chars) only at DEBUG
+    # when sampled. Nothing is computed when the logger is not enabled for level.
+    if not logger.isEnabledFor(level):
+        return
+    fields.update(summarize(payload))
+    if logger.isEnabledFor(logging.DEBUG) and SETTINGS['payload_max_chars'] and sampled():
+        text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+        fields['payload'] = text[:SETTINGS['payload_max_chars']]
+    logger.log(level, message, extra={'fields': fields})
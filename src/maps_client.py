@@ -0,0 +1,147 @@
+import random
+import threading
+import time
+import requests
+from urllib.parse import urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+from .constants import (
+    MAPS_TIMEOUT,
+    MAPS_MAX_RETRIES,
+    MAPS_BACKOFF_BASE,
+    MAPS_BACKOFF_MAX,
+    MAPS_MAX_CONCURRENCY,
+    MAPS_RATE_LIMITS,
+)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Reserves a token and sleeps until it is available, returns the time waited
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class MapsClient(object):
+    TEXT_SEARCH_URL = 'https://maps.googleapis.com/maps/api/place/textsearch/json'
+    PLACE_DETAILS_URL = 'https://maps.googleapis.com/maps/api/place/details/json'
+    DIRECTIONS_URL = 'https://maps.googleapis.com/maps/api/directions/json'
+    SEARCH_TEXT_URL = 'https://places.googleapis.com/v1/places:searchText'
+    NEARBY_SEARCH_URL = 'https://places.googleapis.com/v1/places:searchNearby'
+    COMPUTE_ROUTES_URL = 'https://routes.googleapis.com/directions/v2:computeRoutes'
+
+    def __init__(self, api_key, max_concurrency=MAPS_MAX_CONCURRENCY, rate_limits=MAPS_RATE_LIMITS, base_url=None):
+        self.api_key = api_key
+        # Sends every request to a local stand-in (e.g. http://localhost:8081) with the same
+        # paths, while URLs (and so cache keys) keep naming the Google hosts
+        self.base_url = urlsplit(base_url) if base_url else None
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=len(rate_limits), pool_maxsize=max_concurrency)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.buckets = {endpoint: TokenBucket(rate) for endpoint, rate in rate_limits.items()}
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'retries': 0, 'errors': 0, 'throttled': 0, 'throttled_seconds': 0.0}
+        # Requests on the wire, the pool keeps at most the peak of them as open connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def _enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(MAPS_BACKOFF_MAX, int(retry_after))
+        return random.uniform(0, min(MAPS_BACKOFF_MAX, MAPS_BACKOFF_BASE * 2 ** attempt))
+
+    def request(self, endpoint, method, url, **kwargs):
+        kwargs.setdefault('timeout', MAPS_TIMEOUT)
+        if self.base_url is not None:
+            url = urlunsplit(self.base_url[:2] + urlsplit(url)[2:])
+        bucket = self.buckets.get(endpoint)
+        for attempt in range(MAPS_MAX_RETRIES + 1):
+            if bucket is not None:
+                waited = bucket.acquire()
+                if waited > 0:
+                    self._count('throttled')
+                    self._count('throttled_seconds', waited)
+            self._count('requests')
+            try:
+                with self.slots:
+                    self._enter()
+                    try:
+                        response = self.session.request(method, url, **kwargs)
+                    finally:
+                        self._leave()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == MAPS_MAX_RETRIES:
+                    self._count('errors')
+                    raise
+                self._count('retries')
+                time.sleep(self._backoff(attempt))
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == MAPS_MAX_RETRIES:
+                if response.status_code >= 400:
+                    self._count('errors')
+                return response
+            self._count('retries')
+            time.sleep(self._backoff(attempt, response))
+
+    def _v1_headers(self, field_mask):
+        return {
+            'Content-Type': 'application/json',
+            'X-Goog-Api-Key': self.api_key,
+            'X-Goog-FieldMask': field_mask,
+        }
+
+    def text_search_url(self, query, place_type):
+        return f"{self.TEXT_SEARCH_URL}?query={query}&type={place_type}&key={self.api_key}"
+
+    def text_search(self, url):
+        return self.request('textsearch', 'GET', url)
+
+    def place_details(self, place_id, fields):
+        return self.request('details', 'GET', self.PLACE_DETAILS_URL, params={'place_id': place_id, 'fields': fields, 'key': self.api_key})
+
+    def directions(self, params):
+        return self.request('directions', 'GET', self.DIRECTIONS_URL, params={**params, 'key': self.api_key})
+
+    def search_text(self, payload, field_mask):
+        return self.request('textsearch', 'POST', self.SEARCH_TEXT_URL, json=payload, headers=self._v1_headers(field_mask))
+
+    def nearby_search(self, payload, field_mask):
+        return self.request('nearbysearch', 'POST', self.NEARBY_SEARCH_URL, json=payload, headers=self._v1_headers(field_mask))
+
+    def compute_routes(self, payload, field_mask):
+        return self.request('routes', 'POST', self.COMPUTE_ROUTES_URL, json=payload, headers=self._v1_headers(field_mask))
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, in_flight=self.in_flight, peak_in_flight=self.peak_in_flight)
+        stats['throttled_seconds'] = round(stats['throttled_seconds'], 3)
+        return stats
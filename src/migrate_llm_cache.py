@@ -0,0 +1,64 @@
+import sys
+import os
+import pymongo
+from pymongo import UpdateOne
+
+# Add the parent directory of 'src' to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils import load_secrets
+from src.cache import plan_cache_key
+
+BATCH_SIZE = 500
+DUPLICATE_KEY_ERROR = 11000
+
+def delete_ids(collection, ids):
+    for i in range(0, len(ids), BATCH_SIZE):
+        collection.delete_many({'_id': {'$in': ids[i:i + BATCH_SIZE]}})
+
+def write_keys(collection, keys):
+    # Sets the new keys of (key, _id) pairs. Documents whose key was taken meanwhile (by the
+    # running app) are duplicates of a newer plan, their ids are returned for removal.
+    try:
+        collection.bulk_write([UpdateOne({'_id': _id}, {'$set': {'key': key}}) for key, _id in keys], ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error['code'] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        return [keys[error['index']][1] for error in errors]
+    return []
+
+def migrate(collection):
+    # Re-keys every LLMCache document on its canonical plan key. Documents that collapse
+    # onto the same key are duplicates of one plan, the one already holding the key (e.g.
+    # written by the running app under the unique index) is kept and the others are removed
+    # before any key is written.
+    owners = {}
+    duplicates = []
+    for document in collection.find({}, {'input': 1, 'key': 1}):
+        key = plan_cache_key(document.get('input') or {})
+        owner = owners.get(key)
+        if owner is None:
+            owners[key] = document
+        elif document.get('key') == key and owner.get('key') != key:
+            duplicates.append(owner['_id'])
+            owners[key] = document
+        else:
+            duplicates.append(document['_id'])
+    delete_ids(collection, duplicates)
+
+    stale = [(key, document['_id']) for key, document in owners.items() if document.get('key') != key]
+    # Old keys are dropped first, so no document still holds a key another one moves to
+    for i in range(0, len(stale), BATCH_SIZE):
+        collection.update_many({'_id': {'$in': [_id for _, _id in stale[i:i + BATCH_SIZE]]}}, {'$unset': {'key': ''}})
+    taken = []
+    for i in range(0, len(stale), BATCH_SIZE):
+        taken += write_keys(collection, stale[i:i + BATCH_SIZE])
+    delete_ids(collection, taken)
+    return {'plans': len(owners) - len(taken), 'duplicates_removed': len(duplicates) + len(taken)}
+
+if __name__ == '__main__':
+    secrets = load_secrets()
+    mongo_client = pymongo.MongoClient(secrets['MONGO_CONNECTION_STRING'])
+    llm_collection = mongo_client.get_database('TripTonicDump').get_collection('LLMCache')
+    print(migrate(llm_collection))
@@ -0,0 +1,173 @@
+import math
+import numpy as np
+from .places import Place
+from .hours import trip_weekdays, window_mask, open_during
+from .utils import haversine_many, coordinates, parse_24_hour_time, place_intervals, place_index, to_minutes
+
+# Average door to door speed used to turn distances into travel time
+SPEED_KMH = {'DRIVING': 35, 'TRANSIT': 20, 'BICYCLING': 14, 'BIKING': 14, 'WALKING': 4.5}
+VISIT_MINUTES = {'tourist': 120, 'restaurant': 75, 'transit': 15}
+DEFAULT_WINDOW = '07:00-20:00'
+SLOT_MINUTES = 5
+
+def distance_matrix(places):
+    latitudes, longitudes = coordinates(places)
+    return haversine_many(latitudes[:, None], longitudes[:, None], latitudes[None, :], longitudes[None, :])
+
+def split_into_days(places, duration):
+    # Sweeps around the centroid so every day covers one contiguous slice of the area
+    days = max(1, min(duration, len(places)))
+    if days == 1:
+        return [list(range(len(places)))]
+    latitudes, longitudes = coordinates(places)
+    lat0, lon0 = latitudes.mean(), longitudes.mean()
+    angles = np.arctan2(latitudes - lat0, (longitudes - lon0) * math.cos(math.radians(lat0)))
+    order = np.argsort(angles, kind='stable')
+    # Start the sweep right after the widest empty sector, so no day straddles it
+    sorted_angles = angles[order]
+    gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * math.pi))
+    order = np.roll(order, -((int(np.argmax(gaps)) + 1) % len(order)))
+    return [[int(i) for i in chunk] for chunk in np.array_split(order, days)]
+
+def nearest_neighbour(indices, matrix):
+    if len(indices) <= 2:
+        return list(indices)
+    # Open path, so start at the stop that is farthest from the rest of the day
+    remaining = list(indices)
+    current = max(remaining, key=lambda i: (matrix[i, remaining].sum(), -i))
+    path = [current]
+    remaining.remove(current)
+    while remaining:
+        current = min(remaining, key=lambda i: (matrix[current, i], i))
+        path.append(current)
+        remaining.remove(current)
+    return path
+
+def two_opt(path, matrix):
+    path = list(path)
+    n = len(path)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                a = path[i - 1] if i > 0 else None
+                b, c = path[i], path[j]
+                d = path[j + 1] if j < n - 1 else None
+                before = (matrix[a, b] if a is not None else 0) + (matrix[c, d] if d is not None else 0)
+                after = (matrix[a, c] if a is not None else 0) + (matrix[b, d] if d is not None else 0)
+                if after < before - 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+    return path
+
+def opening_window(place, weekday):
+    intervals = place_intervals(place, weekday)
+    if not intervals:
+        return 0, -1
+    return min(start for start, _ in intervals), max(end for _, end in intervals)
+
+def trip_window(params):
+    try:
+        start, end = parse_24_hour_time(params.get('timings') or DEFAULT_WINDOW)
+    except Exception:
+        start, end = parse_24_hour_time(DEFAULT_WINDOW)
+    return to_minutes(start), to_minutes(end)
+
+def round_up(minutes):
+    return int(math.ceil(minutes / SLOT_MINUTES) * SLOT_MINUTES)
+
+def plan_times(places, path, matrix, params, weekday):
+    # Returns the start minute of every stop and a cost of (stops reached after closing, minutes
+    # past the end of the timings, end of day). Stops that do not fit run past the timings
+    # rather than all starting at their end.
+    window_start, window_end = trip_window(params)
+    speed = SPEED_KMH.get(params.get('mode_of_transport'), SPEED_KMH['DRIVING'])
+    current = window_start
+    previous = None
+    times = []
+    late = 0
+    for i in path:
+        place = places[i]
+        if previous is not None:
+            current = round_up(current + matrix[previous, i] / speed * 60)
+        opens, closes = opening_window(place, weekday)
+        current = max(current, opens)
+        if current > closes:
+            late += 1
+        times.append(current)
+        current += VISIT_MINUTES.get(place.get('type'), 60)
+        previous = i
+    return times, (late, max(0, current - window_end), current)
+
+def schedule_day(places, path, day, matrix, params, weekday):
+    # The same route driven backwards can fit opening hours better. Returns the path and the
+    # stops of it that start after the timings end.
+    candidates = [path, path[::-1]]
+    timings = [plan_times(places, candidate, matrix, params, weekday) for candidate in candidates]
+    best = min(range(len(candidates)), key=lambda k: timings[k][1])
+    path, times = candidates[best], timings[best][0]
+    window_end = trip_window(params)[1]
+    for i, minutes in zip(path, times):
+        places[i]['day'] = day
+        places[i]['time'] = '{:02d}:{:02d}'.format(*divmod(min(minutes, 23 * 60 + 59), 60))
+    return path, [i for i, minutes in zip(path, times) if minutes > window_end]
+
+def day_of(place, duration):
+    try:
+        return min(max(int(place.get('day', 1)), 1), duration)
+    except (TypeError, ValueError):
+        return 1
+
+def move_closed_places(days, matrix, is_open, weekdays):
+    # Moves every stop to the closest day (by mean distance to its stops) the place is
+    # open on, when it is closed on the day it was given. Places closed all trip stay put.
+    # is_open(i, weekday) tells whether place i is open within the timings on weekday.
+    for day in sorted(days):
+        for i in list(days[day]):
+            if is_open(i, weekdays[day - 1]):
+                continue
+            options = [other for other in range(1, len(weekdays) + 1) if is_open(i, weekdays[other - 1])]
+            if not options:
+                continue
+            best = min(options, key=lambda other: (matrix[i, days[other]].mean() if days.get(other) else 0, other))
+            days[day].remove(i)
+            days.setdefault(best, []).append(i)
+    return {day: group for day, group in days.items() if group}
+
+def optimize_itinerary(places, params, keep_days=False):
+    # Groups places into days by location, orders each day with nearest neighbour
+    # plus 2-opt on a haversine distance matrix and assigns visiting times that wait
+    # for opening hours inside the trip's daily timings window. Every trip day is
+    # checked against the weekday it falls on.
+    places = [place for place in places if isinstance(place, (dict, Place))]
+    if not places:
+        return places
+    duration = max(1, int(params.get('duration') or 1))
+    weekdays = trip_weekdays(params)
+    matrix = distance_matrix(places)
+    if keep_days:
+        days = {}
+        for i, place in enumerate(places):
+            days.setdefault(day_of(place, duration), []).append(i)
+    else:
+        days = {day: group for day, group in enumerate(split_into_days(places, duration), 1)}
+    indexes = [place_index(place) for place in places]
+    mask = window_mask(*trip_window(params))
+    is_open = lambda i, weekday: open_during(indexes[i], weekday, mask)
+    days = move_closed_places(days, matrix, is_open, weekdays)
+
+    # Stops that start after a day's timings move on to the next trip day when they are open then
+    ordered = []
+    day = min(days)
+    while day in days:
+        path = two_opt(nearest_neighbour(days[day], matrix), matrix)
+        path, overflow = schedule_day(places, path, day, matrix, params, weekdays[day - 1])
+        moved = [i for i in overflow if day < duration and is_open(i, weekdays[day])] if overflow else []
+        if moved:
+            path = [i for i in path if i not in moved]
+            days.setdefault(day + 1, []).extend(moved)
+            path, _ = schedule_day(places, path, day, matrix, params, weekdays[day - 1])
+        ordered.extend(places[i] for i in path)
+        day = min((other for other in days if other > day), default=None)
+    return ordered
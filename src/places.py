@@ -0,0 +1,53 @@
+import copy
+
+# Public JSON shape of a place, in the order clients have always received it
+PUBLIC_FIELDS = (
+    'id', 'type', 'name', 'website', 'description', 'latitude', 'longitude', 'latitudeDelta', 'longitudeDelta',
+    'business_status', 'serves', 'rating', 'total_reviews', 'price_range', 'todays_working_hours', 'notes', 'score',
+)
+# Only used while planning, never sent to clients or stored with a plan
+INTERNAL_FIELDS = ('opening_intervals', 'open_slots')
+SCHEDULE_FIELDS = ('day', 'time')
+
+class Place(object):
+    # Slotted place used between cleaning and the response. It answers the dict calls the
+    # pipeline makes (get, [], []=, in) so filters and the optimizer work on either, and
+    # becomes a plain dict once, in to_dict, when a plan leaves the server.
+    __slots__ = PUBLIC_FIELDS + INTERNAL_FIELDS + SCHEDULE_FIELDS
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def copy(self):
+        return copy.copy(self)
+
+    def to_dict(self):
+        fields = PUBLIC_FIELDS + SCHEDULE_FIELDS
+        return {key: getattr(self, key) for key in fields if hasattr(self, key)}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+def to_public(places):
+    # Plans mix Place objects with dicts coming back from the LLM or LLMCache
+    return [place.to_dict() if isinstance(place, Place) else place for place in places]
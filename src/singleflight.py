@@ -0,0 +1,73 @@
+import threading
+from .constants import SINGLE_FLIGHT_TIMEOUT
+
+class Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError('no result after {}s'.format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class SingleFlight(object):
+    # Concurrent callers with the same key share one execution, the first caller (leader)
+    # runs it and the others (followers) wait for its result instead of repeating the work.
+    # A follower waits at most timeout seconds, then drops the call of a leader that never
+    # finished (e.g. an abandoned generator) so the key can be led again.
+    def __init__(self, name, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = {'leaders': 0, 'coalesced': 0, 'abandoned': 0}
+
+    def begin(self, key):
+        # Returns (call, leader). A leader must always call finish with the same call.
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.counters['coalesced'] += 1
+                return call, False
+            call = Call()
+            self.calls[key] = call
+            self.counters['leaders'] += 1
+            return call, True
+
+    def abandon(self, key, call):
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+                self.counters['abandoned'] += 1
+
+    def finish(self, key, call, result=None, error=None):
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    def do(self, key, fn, *args, **kwargs):
+        call, leader = self.begin(key)
+        if not leader:
+            try:
+                return call.wait(self.timeout)
+            except TimeoutError:
+                self.abandon(key, call)
+                return self.do(key, fn, *args, **kwargs)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, 'in_flight': len(self.calls)}
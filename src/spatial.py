@@ -0,0 +1,130 @@
+import math
+import threading
+import cachetools
+import numpy as np
+from pymongo import UpdateOne
+from .utils import haversine_many
+from .constants import SPATIAL_CELL_DEGREES, SPATIAL_MAX_CELLS
+
+KM_PER_DEGREE = 111.32
+PROJECTION = {'place_id': 1, 'name': 1, 'geometry.location': 1, 'types': 1, 'score': 1, 'rating': 1, 'user_ratings_total': 1}
+
+def place_location(place):
+    location = place.get('geometry', {}).get('location', {})
+    return location.get('lat'), location.get('lng')
+
+def grid_cell(lat, lng, cell_size=SPATIAL_CELL_DEGREES):
+    return '{}:{}'.format(math.floor(lat / cell_size), math.floor(lng / cell_size))
+
+def cells_around(lat, lng, radius_km, cell_size=SPATIAL_CELL_DEGREES):
+    lat_span = radius_km / KM_PER_DEGREE
+    lng_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    lat_cells = range(math.floor((lat - lat_span) / cell_size), math.floor((lat + lat_span) / cell_size) + 1)
+    lng_cells = range(math.floor((lng - lng_span) / cell_size), math.floor((lng + lng_span) / cell_size) + 1)
+    return ['{}:{}'.format(i, j) for i in lat_cells for j in lng_cells]
+
+class _CellCache(cachetools.LRUCache):
+    def __init__(self, maxsize, on_evict):
+        super().__init__(maxsize=maxsize)
+        self.on_evict = on_evict
+
+    def popitem(self):
+        cell, entries = super().popitem()
+        self.on_evict(cell)
+        return cell, entries
+
+class SpatialIndex(object):
+    # In-memory grid over geocoded places. Cells are filled lazily from the PlacesCache
+    # documents stored under the same 'cell' key, so only areas that get queried are loaded.
+    # At most max_cells cells are kept, an evicted cell is read again on its next lookup.
+    def __init__(self, collection, cell_size=SPATIAL_CELL_DEGREES, max_cells=SPATIAL_MAX_CELLS):
+        self.collection = collection
+        self.cell_size = cell_size
+        self.lock = threading.Lock()
+        self.cells = _CellCache(max_cells, self._evicted)
+        self.loaded = set()
+        self.evictions = 0
+
+    def _evicted(self, cell):
+        # Called by self.cells with self.lock held
+        self.loaded.discard(cell)
+        self.evictions += 1
+
+    def _entry(self, place):
+        lat, lng = place_location(place)
+        if lat is None or lng is None or not place.get('place_id'):
+            return None, None
+        entry = {
+            'place_id': place['place_id'],
+            'name': place.get('name', ''),
+            'latitude': lat,
+            'longitude': lng,
+            'types': place.get('types', []),
+            'score': place.get('score', 0.5),
+            'rating': place.get('rating'),
+            'user_ratings_total': place.get('user_ratings_total'),
+        }
+        return grid_cell(lat, lng, self.cell_size), entry
+
+    def add_many(self, places):
+        with self.lock:
+            for place in places:
+                cell, entry = self._entry(place)
+                if cell is not None:
+                    self.cells.setdefault(cell, {})[entry['place_id']] = entry
+
+    def _load(self, cells):
+        missing = [cell for cell in cells if cell not in self.loaded]
+        if not missing:
+            return
+        documents = list(self.collection.find({'cell': {'$in': missing}}, PROJECTION))
+        self.add_many(documents)
+        with self.lock:
+            # Empty cells are kept too, so every loaded cell can be evicted
+            for cell in missing:
+                self.cells.setdefault(cell, {})
+                self.loaded.add(cell)
+
+    def nearby(self, lat, lng, radius_km, place_type=None, limit=None):
+        # Places of place_type within radius_km, best scored first
+        cells = cells_around(lat, lng, radius_km, self.cell_size)
+        self._load(cells)
+        with self.lock:
+            candidates = [entry for cell in cells for entry in self.cells.get(cell, {}).values()]
+        if place_type:
+            candidates = [entry for entry in candidates if place_type in entry['types']]
+        if not candidates:
+            return []
+        latitudes = np.fromiter((entry['latitude'] for entry in candidates), dtype=float, count=len(candidates))
+        longitudes = np.fromiter((entry['longitude'] for entry in candidates), dtype=float, count=len(candidates))
+        distances = haversine_many(lat, lng, latitudes, longitudes)
+        places = [{**entry, 'distance_km': round(float(distance), 3)} for entry, distance in zip(candidates, distances) if distance <= radius_km]
+        places.sort(key=lambda place: (place['score'] or 0), reverse=True)
+        return places[:limit] if limit else places
+
+    def invalidate(self):
+        # Cells are re-read from Mongo on their next lookup
+        with self.lock:
+            self.loaded.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'cells': len(self.cells), 'loaded_cells': len(self.loaded), 'places': sum(len(cell) for cell in self.cells.values()), 'evictions': self.evictions}
+
+def backfill_cells(collection, cell_size=SPATIAL_CELL_DEGREES, batch_size=500):
+    # Adds the grid cell to PlacesCache documents written before the spatial index existed
+    updates = []
+    updated = 0
+    for document in collection.find({'cell': {'$exists': False}}, {'geometry.location': 1}):
+        lat, lng = place_location(document)
+        if lat is None or lng is None:
+            continue
+        updates.append(UpdateOne({'_id': document['_id']}, {'$set': {'cell': grid_cell(lat, lng, cell_size)}}))
+        if len(updates) >= batch_size:
+            collection.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+        updated += len(updates)
+    return updated
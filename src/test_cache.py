@@ -0,0 +1,53 @@
+import datetime
+import threading
+import concurrent.futures
+import mongomock
+from .cache import CachedCollection, utcnow
+from .data_loaders import DataLoader
+
+POLICY = {'fresh': 60, 'expire': 120}
+
+class Spatial(object):
+    def add_many(self, places):
+        pass
+
+def expired_places():
+    collection = mongomock.MongoClient().db.PlacesCache
+    collection.create_index('place_id', unique=True)
+    cached_at = utcnow() - datetime.timedelta(seconds=POLICY['expire'] + 60)
+    collection.insert_one({'place_id': 'p1', 'name': 'Old', 'cached_at': cached_at})
+    return collection, cached_at
+
+def test_expired_documents_are_misses():
+    collection, _ = expired_places()
+    cache = CachedCollection(collection, 'place_id', 16, 60, policy=POLICY)
+    assert cache.find_one('p1') is None
+    assert cache.stats()['expired'] == 1
+
+def test_refetched_details_replace_an_expired_copy():
+    collection, cached_at = expired_places()
+    loader = DataLoader.__new__(DataLoader)
+    loader.places_cache = CachedCollection(collection, 'place_id', 16, 60, policy=POLICY)
+    loader.spatial = Spatial()
+    loader.save_place_details([{'place_id': 'p1', 'name': 'New', 'geometry': {'location': {'lat': 1.0, 'lng': 2.0}}}])
+
+    stored = collection.find_one({'place_id': 'p1'})
+    assert stored['name'] == 'New' and stored['cell'] == '10:20'
+    assert stored['cached_at'] > cached_at
+    assert collection.count_documents({}) == 1
+    # A new process finds the fresh copy in Mongo
+    fresh = CachedCollection(collection, 'place_id', 16, 60, policy=POLICY)
+    assert fresh.find_one('p1')['name'] == 'New'
+
+def test_refreshes_over_the_limit_are_skipped():
+    collection = mongomock.MongoClient().db.LLMCache
+    stale_at = utcnow() - datetime.timedelta(seconds=POLICY['fresh'] + 1)
+    collection.insert_many([{'key': key, 'cached_at': stale_at} for key in ('a', 'b')])
+    release = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    cache = CachedCollection(collection, 'key', 16, 60, policy=POLICY, refresh=lambda key, document: release.wait(5), executor=executor, refresh_limit=1)
+    assert cache.find_one('a') is not None and cache.find_one('b') is not None
+    release.set()
+    executor.shutdown(wait=True)
+    stats = cache.stats()
+    assert (stats['refreshed'], stats['refresh_skipped'], stats['refresh_failed']) == (1, 1, 0)
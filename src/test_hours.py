@@ -0,0 +1,60 @@
+from .hours import parse_hours, parse_weekday_text, slot_mask, weekly_index, window_mask, open_during
+from .utils import open_mask
+
+def place(week):
+    return {'opening_intervals': week}
+
+def test_parse_hours_ranges():
+    assert parse_hours('9:00 AM - 5:00 PM') == [[540, 1020]]
+    assert parse_hours('11:00 AM - 2:30 PM, 5:00 - 10:00 PM') == [[660, 870], [1020, 1320]]
+    assert parse_hours('09:00-17:30') == [[540, 1050]]
+
+def test_parse_hours_overnight():
+    assert parse_hours('9:00 PM - 2:00 AM') == [[1260, 1560]]
+    assert parse_hours('6:00 PM - 12:00 AM') == [[1080, 1440]]
+
+def test_parse_hours_closed_and_24_hours():
+    assert parse_hours('Closed') == []
+    assert parse_hours('Open 24 hours') == [[0, 1440]]
+
+def test_parse_hours_unicode_dashes_and_spaces():
+    assert parse_hours('9:00 AM – 5:00 PM') == [[540, 1020]]
+    assert parse_hours('9:00 AM — 5:00 PM') == [[540, 1020]]
+
+def test_parse_hours_unknown_text():
+    assert parse_hours('by appointment') is None
+
+def test_parse_weekday_text():
+    week = parse_weekday_text(['Monday: 9:00 AM – 5:00 PM', 'Tuesday: Closed', 'Someday: 1:00 - 2:00 PM'])
+    assert week[0] == [[540, 1020]]
+    assert week[1] == []
+    assert week[2:] == [None] * 5
+
+def test_slot_mask():
+    assert slot_mask(0, 1) == 1
+    assert slot_mask(9 * 60, 10 * 60) == ((1 << 60) - 1) << 540
+    assert slot_mask(1400, 1500) == ((1 << 40) - 1) << 1400
+    assert slot_mask(600, 600) == 0
+
+def test_weekly_index_carries_past_midnight():
+    index = weekly_index([[[1320, 1560]]] + [[]] * 6)
+    assert open_during(index, 0, window_mask(23 * 60, 23 * 60 + 30))
+    assert open_during(index, 1, window_mask(60, 90))
+    assert not open_during(index, 1, window_mask(3 * 60, 4 * 60))
+
+def test_open_mask_checks_every_trip_weekday():
+    places = [place([[[540, 1020]]] + [[]] * 6), place([[]] * 6 + [[[540, 1020]]]), place([[]] * 7)]
+    assert open_mask(places, '10:00-12:00', [0]).tolist() == [True, False, False]
+    assert open_mask(places, '10:00-12:00', [0, 6]).tolist() == [True, True, False]
+    assert open_mask(places, '18:00-20:00', [0, 6]).tolist() == [False, False, False]
+
+def test_open_mask_is_exact_to_the_minute():
+    assert open_mask([place([[[615, 1080]]] * 7)], '09:00-10:00', [0]).tolist() == [False]
+    assert open_mask([place([[[420, 520]]] * 7)], '08:50-10:00', [0]).tolist() == [False]
+    # The end of the timings is inclusive
+    assert open_mask([place([[[600, 1080]]] * 7)], '09:00-10:00', [0]).tolist() == [True]
+
+def test_open_mask_uses_hours_carried_past_midnight():
+    week = [[[1320, 1560]]] + [[]] * 6
+    assert open_mask([place(week)], '01:00-01:30', [1]).tolist() == [True]
+    assert open_mask([place(week)], '02:10-03:00', [1]).tolist() == [False]
@@ -0,0 +1,64 @@
+import numpy as np
+from .optimizer import plan_times, two_opt, schedule_day, distance_matrix, optimize_itinerary
+
+PARAMS = {'timings': '09:00-18:00', 'mode_of_transport': 'DRIVING'}
+
+def place(latitude, longitude, hours=None, type_='tourist'):
+    return {'latitude': latitude, 'longitude': longitude, 'type': type_, 'todays_working_hours': hours or 'Open 24 hours'}
+
+def path_length(path, matrix):
+    return sum(matrix[a, b] for a, b in zip(path, path[1:]))
+
+def test_two_opt_removes_crossings():
+    # Four points on a line visited out of order
+    places = [place(0, 0), place(0, 0.2), place(0, 0.1), place(0, 0.3)]
+    matrix = distance_matrix(places)
+    path = two_opt([0, 1, 2, 3], matrix)
+    assert path in ([0, 2, 1, 3], [3, 1, 2, 0])
+    assert path_length(path, matrix) < path_length([0, 1, 2, 3], matrix)
+
+def test_two_opt_keeps_an_optimal_path():
+    matrix = np.array([[0, 1, 2], [1, 0, 1], [2, 1, 0]], dtype=float)
+    assert two_opt([0, 1, 2], matrix) == [0, 1, 2]
+
+def test_plan_times_adds_visits_and_travel():
+    places = [place(0, 0), place(0, 0.1)]
+    matrix = distance_matrix(places)
+    times, (late, _, end) = plan_times(places, [0, 1], matrix, PARAMS, 0)
+    # 11 km at 35 km/h is 19 minutes, rounded up to the next 5 minute slot
+    assert times == [9 * 60, 11 * 60 + 20]
+    assert late == 0
+    assert end == 13 * 60 + 20
+
+def test_plan_times_waits_for_opening():
+    places = [place(0, 0, '2:00 PM - 6:00 PM')]
+    times, (late, _, _) = plan_times(places, [0], distance_matrix(places), PARAMS, 0)
+    assert times == [14 * 60]
+    assert late == 0
+
+def test_plan_times_counts_stops_reached_after_closing():
+    places = [place(0, 0), place(0, 0.001, '9:00 AM - 10:00 AM')]
+    times, (late, _, _) = plan_times(places, [0, 1], distance_matrix(places), PARAMS, 0)
+    assert times[1] > 10 * 60
+    assert late == 1
+
+def test_schedule_day_reverses_when_that_fits_opening_hours():
+    places = [place(0, 0), place(0, 0.001, '9:00 AM - 10:00 AM')]
+    path, overflow = schedule_day(places, [0, 1], 1, distance_matrix(places), PARAMS, 0)
+    assert path == [1, 0] and overflow == []
+    assert places[1]['time'] == '09:00' and places[0]['day'] == 1
+
+def test_plan_times_runs_past_the_timings_instead_of_stacking_stops():
+    # Six two hour visits do not fit in 09:00-18:00
+    places = [place(0, i * 0.0001) for i in range(6)]
+    times, (late, overflow, end) = plan_times(places, list(range(6)), distance_matrix(places), PARAMS, 0)
+    assert all(later - earlier >= 120 for earlier, later in zip(times, times[1:]))
+    assert overflow == end - 18 * 60 > 0
+
+def test_overflowing_stops_move_to_the_next_day():
+    places = [place(0, i * 0.0001) for i in range(6)]
+    ordered = optimize_itinerary(places, {**PARAMS, 'duration': 2, 'start_date': '2026-10-19'}, keep_days=True)
+    for day in (1, 2):
+        times = sorted(p['time'] for p in ordered if p['day'] == day)
+        assert times and times[-1] <= '18:00'
+        assert len(set(times)) == len(times)
@@ -0,0 +1,68 @@
+import threading
+import time
+import pytest
+from .singleflight import SingleFlight
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'plan'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', work)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', work))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while flight.stats()['coalesced'] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ['plan'] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'leaders': 1, 'coalesced': 3, 'abandoned': 0, 'in_flight': 0}
+
+def test_followers_get_the_leader_error():
+    flight = SingleFlight('test')
+    call, leader = flight.begin('key')
+    follower_call, follower_leader = flight.begin('key')
+    assert leader and not follower_leader and follower_call is call
+    flight.finish('key', call, error=ValueError('boom'))
+    with pytest.raises(ValueError):
+        follower_call.wait()
+
+def test_finished_keys_run_again():
+    flight = SingleFlight('test')
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+    assert flight.stats()['in_flight'] == 0
+
+def test_failed_leader_frees_the_key():
+    flight = SingleFlight('test')
+
+    def fail():
+        raise RuntimeError('down')
+
+    with pytest.raises(RuntimeError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+def test_followers_take_over_from_a_stuck_leader():
+    flight = SingleFlight('test', timeout=0.01)
+    stuck, leader = flight.begin('key')
+    assert leader
+    assert flight.do('key', lambda: 'mine') == 'mine'
+    assert flight.stats() == {'leaders': 2, 'coalesced': 1, 'abandoned': 1, 'in_flight': 0}
+    # The stuck leader finishing late leaves the key alone
+    flight.finish('key', stuck, 'late')
+    assert flight.stats()['in_flight'] == 0
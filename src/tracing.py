@@ -0,0 +1,122 @@
+import contextvars
+import re
+import threading
+import time
+
+# Timed spans around request stages. Every span is observed in a Prometheus histogram served
+# on /metrics, and spans of the current request are collected for its Server-Timing header.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+NO_CACHE = 'none'
+TOKEN = re.compile(r'[^A-Za-z0-9_.-]')
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(pairs):
+    return ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs)
+
+def format_number(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+class Histogram(object):
+    def __init__(self, name, documentation, label_names, buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            series = {key: {**value, 'buckets': list(value['buckets'])} for key, value in self.series.items()}
+        for key in sorted(series):
+            labels = list(zip(self.label_names, key))
+            for bound, count in zip(self.buckets + (float('inf'),), series[key]['buckets'] + [series[key]['count']]):
+                lines.append('{}_bucket{{{}}} {}'.format(self.name, format_labels(labels + [('le', format_number(bound))]), count))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, format_labels(labels), format_number(series[key]['sum'])))
+            lines.append('{}_count{{{}}} {}'.format(self.name, format_labels(labels), series[key]['count']))
+        return lines
+
+class Registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def histogram(self, name, documentation, label_names, buckets=BUCKETS):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, documentation, label_names, buckets)
+            return self.histograms[name]
+
+    def render(self):
+        with self.lock:
+            histograms = list(self.histograms.values())
+        return '\n'.join(line for histogram in histograms for line in histogram.render()) + '\n'
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('triptonic_stage_seconds', 'Time spent in a request stage', ('stage', 'cache'))
+REQUEST_SECONDS = REGISTRY.histogram('triptonic_request_seconds', 'Time to answer a request', ('endpoint', 'method', 'status'))
+
+_spans = contextvars.ContextVar('spans', default=None)
+
+def start_request():
+    # Collects the spans of this request, and of work submitted with submit below
+    spans = []
+    _spans.set(spans)
+    return spans
+
+def current_spans():
+    return _spans.get()
+
+def record(stage, seconds, cache=NO_CACHE):
+    STAGE_SECONDS.observe(seconds, stage=stage, cache=cache or NO_CACHE)
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((stage, seconds, cache or NO_CACHE))
+
+class Span(object):
+    # with span('filter'): ...  The block can set span.cache to 'hit' or 'miss' before it ends.
+    def __init__(self, stage, cache=NO_CACHE):
+        self.stage = stage
+        self.cache = cache
+
+    def __enter__(self):
+        self.tic = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.stage, time.perf_counter() - self.tic, self.cache)
+        return False
+
+def span(stage, cache=NO_CACHE):
+    return Span(stage, cache)
+
+def submit(executor, fn, *args, **kwargs):
+    # executor.submit that keeps the caller's request, so spans in fn reach its Server-Timing
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def server_timing(spans, total=None):
+    entries = []
+    for stage, seconds, cache in spans:
+        entry = '{};dur={:.1f}'.format(TOKEN.sub('_', stage), seconds * 1000)
+        if cache != NO_CACHE:
+            entry += ';desc="{}"'.format(cache)
+        entries.append(entry)
+    if total is not None:
+        entries.append('total;dur={:.1f}'.format(total * 1000))
+    return ', '.join(entries)
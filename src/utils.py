@@ -1,38 +1,54 @@
 import os
 import math
+import logging
 from dotenv import load_dotenv
 from pathlib import Path
 import datetime
 import numpy as np
 import re
+from functools import lru_cache
+from collections import Counter
 from unidecode import unidecode
+from .places import Place
+from .log import get_logger, log_event
+from .hours import HOURS_CACHE_SIZE, DAYS, DEFAULT_INTERVALS, opening_intervals, intervals_on, parse_hours, weekly_index, window_mask, open_during
 
+NON_ASCII_DASH = re.compile(r'[\u2013\u2014\u2015]')
+MISSING_MERIDIEM_SPACE = re.compile(r'(\d)([APM])')
+MISSING_COLON = re.compile(r'(\d{1,2})(\d{2})')
+SPACES = re.compile(r'\s+')
+MERIDIEM = re.compile(r'[APM]')
+
+logger = get_logger('utils')
+
+@lru_cache(maxsize=HOURS_CACHE_SIZE)
 def clean_timing(text):
+  text = text.strip()
   if text.lower() == 'open 24 hours':
     return '12:00 AM - 11:59 PM'
   # Transliterate text to ASCII
   text = unidecode(text)
   
   # Replace non-ASCII dashes with a regular dash
-  text = re.sub(r'[\u2013\u2014\u2015]', '-', text)
+  text = NON_ASCII_DASH.sub('-', text)
   
   # Add space between time and AM/PM if missing
-  text = re.sub(r'(\d)([APM])', r'\1 \2', text)
+  text = MISSING_MERIDIEM_SPACE.sub(r'\1 \2', text)
 
   # Ensure there is a colon between hours and minutes
-  text = re.sub(r'(\d{1,2})(\d{2})', r'\1:\2', text)
+  text = MISSING_COLON.sub(r'\1:\2', text)
 
   # Replace special characters and fix spacing issues
-  text = text.replace(' ', ' ')  # Replace non-breaking spaces (U+202F) with regular space
-  text = text.replace(' ', ' ')  # Replace thin spaces (U+2009) with regular space
+  text = text.replace('\u202f', ' ')  # Replace non-breaking spaces (U+202F) with regular space
+  text = text.replace('\u2009', ' ')  # Replace thin spaces (U+2009) with regular space
   
   # Normalize multiple spaces to a single space
-  text = re.sub(r'\s+', ' ', text)
+  text = SPACES.sub(' ', text)
 
   # Add AM to the first time segment if missing
   if '-' in text:
     before_dash, after_dash = text.split('-', 1)
-    if not re.search(r'[APM]', before_dash):
+    if not MERIDIEM.search(before_dash):
       before_dash += 'AM'
     text = before_dash + ' -' + after_dash
   
@@ -42,9 +58,8 @@ def calculate_minmax_score(places):
   ratings = np.array([place['rating'] for place in places])
   user_ratings_totals = np.array([place['user_ratings_total'] for place in places])
   rmin, rmax = ratings.min(), ratings.max()
-  print(rmin, rmax)
   umin, umax = user_ratings_totals.min(), user_ratings_totals.max()
-  print(umin, umax)
+  log_event(logger, logging.DEBUG, 'Score ranges', rating_min=rmin, rating_max=rmax, ratings_total_min=umin, ratings_total_max=umax)
 
   if rmin == rmax:
     normalized_ratings = np.full_like(ratings, 0.5)
@@ -58,9 +73,13 @@ def calculate_minmax_score(places):
 
   combined_scores = normalized_ratings * 0.5 + normalized_user_ratings_totals * 0.5
 
+  # Scored copies, the places may be documents shared through the cache memory tier
+  scored = []
   for i, place in enumerate(places):
-    place['score'] = combined_scores[i] if combined_scores[i] > 0.05 else 0.4
-  return places
+    place = place.copy()
+    place['score'] = float(combined_scores[i]) if combined_scores[i] > 0.05 else 0.4
+    scored.append(place)
+  return scored
 
 def get_top_n_places(n, places):
   if not places:
@@ -71,10 +90,12 @@ def get_top_n_places(n, places):
 
   return sorted_places[:n]
 
-def get_timings_for_today(timings):
-  current_day_name = datetime.datetime.now().strftime("%A")
+def get_timings_for_today(timings, weekday=None):
+  if weekday is None:
+    weekday = datetime.datetime.now().weekday()
+  current_day_name = DAYS[weekday]
   for timing in timings:
-    if current_day_name.lower() in timing.lower():
+    if current_day_name in timing.lower():
       return clean_timing(''.join(timing.split(':')[1:]).split(',')[0])
   return '10:00 AM - 06:00 PM'
 
@@ -87,18 +108,26 @@ def load_secrets():
   google_maps_key = os.getenv("GOOGLE_MAPS_API_KEY")
   mongo_connection_string = os.getenv("MONGO_CONNECTION_STRING")
   website_domain = os.getenv("WEBSITE_DOMAIN")
+  maps_base_url = os.getenv("MAPS_BASE_URL")
+  gemini_base_url = os.getenv("GEMINI_BASE_URL")
+  log_profile = os.getenv("LOG_PROFILE")
 
   return {
     "GOOGLE_GEMINI_API_KEY": google_gemini_key,
     "GOOGLE_MAPS_API_KEY": google_maps_key,
     "MONGO_CONNECTION_STRING": mongo_connection_string,
-    "WEBSITE_DOMAIN": website_domain
+    "WEBSITE_DOMAIN": website_domain,
+    "MAPS_BASE_URL": maps_base_url,
+    "GEMINI_BASE_URL": gemini_base_url,
+    "LOG_PROFILE": log_profile
   }
 
 def clean_google_maps_data(place_type, places):
+  weekday = datetime.datetime.now().weekday()
   data = []
   for place in places:
-    data.append({
+    week = opening_intervals(place)
+    data.append(Place(**{
       'id': place.get('place_id'),
       'type': place_type,
       'name': place.get('name', ''),
@@ -113,10 +142,12 @@ def clean_google_maps_data(place_type, places):
       'rating': place.get('rating', 3),
       'total_reviews': place.get('user_ratings_total', 1),
       'price_range': place.get('price_level', 2),
-      'todays_working_hours': get_timings_for_today(place.get('current_opening_hours', {}).get('weekday_text', [])),
+      'todays_working_hours': get_timings_for_today(place.get('current_opening_hours', {}).get('weekday_text', []), weekday),
+      'opening_intervals': week,
+      'open_slots': weekly_index(week),
       'notes': 'Notes...',
       'score': place.get('score', 0.5)
-    })
+    }))
   return data
 
 
@@ -136,23 +167,40 @@ def haversine(lat1, lon1, lat2, lon2):
   distance = R * c
   return distance
 
+def haversine_many(lat, lon, latitudes, longitudes):
+  # Same formula as haversine, for one point against arrays of points in a single pass
+  R = 6371.0  # Radius of the Earth in kilometers
+  lat1_rad = np.radians(lat)
+  lat2_rad = np.radians(latitudes)
+
+  dlat = lat2_rad - lat1_rad
+  dlon = np.radians(longitudes) - np.radians(lon)
+
+  a = np.sin(dlat / 2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2)**2
+  c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+  return R * c
+
+def coordinates(points):
+  latitudes = np.fromiter((point['latitude'] for point in points), dtype=float, count=len(points))
+  longitudes = np.fromiter((point['longitude'] for point in points), dtype=float, count=len(points))
+  return latitudes, longitudes
+
 def calculate_centroid(*point_groups):
   all_points = [point for group in point_groups for point in group]
-  total_lat = sum(point['latitude'] for point in all_points)
-  total_lon = sum(point['longitude'] for point in all_points)
-    
-  centroid_lat = total_lat / len(all_points)
-  centroid_lon = total_lon / len(all_points)
-    
+  latitudes, longitudes = coordinates(all_points)
+
+  centroid_lat = float(latitudes.sum()) / len(all_points)
+  centroid_lon = float(longitudes.sum()) / len(all_points)
+
   return (centroid_lat, centroid_lon)
 
+def within_radius_mask(latitudes, longitudes, centroid, radius_km):
+  return haversine_many(centroid[0], centroid[1], latitudes, longitudes) <= radius_km
+
 def filter_points_within_radius(points, centroid, radius_km):
-  filtered_points = []
-  for point in points:
-    distance = haversine(centroid[0], centroid[1], point['latitude'], point['longitude'])
-    if distance <= radius_km:
-      filtered_points.append(point)
-  return filtered_points
+  mask = within_radius_mask(*coordinates(points), centroid, radius_km)
+  return [point for point, keep in zip(points, mask) if keep]
 
 def prepare_servings(place):
   servings = []
@@ -186,18 +234,35 @@ def parse_24_hour_time(time_str):
   
   return start_time, end_time
 
-def filter_places_by_time(places, time_str):
-  filter_start, filter_end = parse_24_hour_time(time_str)
-  filtered_places = []
-  for place in places:
-    try:
-      place_start, place_end = parse_working_hours(place.get('todays_working_hours', '10:00 AM - 06:00 PM'))
-    except Exception as e:
-      print('Error', e, place.get('todays_working_hours', '10:00 AM - 06:00 PM'), place.get('id'))
-      continue
-    if filter_start <= place_end and place_start <= filter_end:
-      filtered_places.append(place)
-  return filtered_places
+def to_minutes(value):
+  return value.hour * 60 + value.minute
+
+def place_intervals(place, weekday):
+  # Intervals parsed at ingestion, places cleaned before that fall back to their hours text
+  if place.get('opening_intervals') is not None:
+    return intervals_on(place['opening_intervals'], weekday)
+  intervals = parse_hours(place.get('todays_working_hours') or '10:00 AM - 06:00 PM')
+  return DEFAULT_INTERVALS if intervals is None else intervals
+
+def place_index(place):
+  # Weekly slot index of a place, see hours.weekly_index
+  if place.get('open_slots') is not None:
+    return place['open_slots']
+  if place.get('opening_intervals') is not None:
+    return weekly_index(place['opening_intervals'])
+  return weekly_index([place_intervals(place, 0)] * len(DAYS))
+
+def open_mask(places, time_str, weekdays=None):
+  # True for places open within the daily timings on at least one of the trip's weekdays
+  if weekdays is None:
+    weekdays = [datetime.datetime.now().weekday()]
+  mask = window_mask(*(to_minutes(value) for value in parse_24_hour_time(time_str)))
+  weekdays = set(weekdays)
+  return np.fromiter((any(open_during(place_index(place), weekday, mask) for weekday in weekdays) for place in places), dtype=bool, count=len(places))
+
+def filter_places_by_time(places, time_str, weekdays=None):
+  keep = open_mask(places, time_str, weekdays)
+  return [place for place, open_ in zip(places, keep) if open_]
 
 def within_budget(budget, price_range):
   if budget == 'low':
@@ -215,7 +280,6 @@ def duration_places_count(duration):
     return 12
   return 20
 
-def stats_printer(places):
-  print('Total restaurant places:', len([p for p in places if p['type'] == 'restaurant']))
-  print('Total tourist places:', len([p for p in places if p['type'] == 'tourist']))
-  print('Total transit places:', len([p for p in places if p['type'] == 'transit']))
+def stats_printer(places, stage=None):
+  counts = Counter(p['type'] for p in places)
+  log_event(logger, logging.DEBUG, 'Places by type', stage=stage, restaurant=counts['restaurant'], tourist=counts['tourist'], transit=counts['transit'])
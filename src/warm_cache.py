@@ -0,0 +1,128 @@
+import sys
+import os
+import argparse
+import concurrent.futures
+import json
+import threading
+import time
+
+# Add the parent directory of 'src' to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils import load_secrets
+from src.maps_client import TokenBucket
+from src.data_loaders import DataLoader
+from src.log import setup_logging
+
+# Fills GoogleMapsAPI and PlacesCache (and with --plans LLMCache) ahead of the first user:
+#   python src/warm_cache.py cities.txt --cuisines italian,mexican --plans --durations 1,2
+# cities.txt has one city per line, # starts a comment. Finished tasks are appended to the
+# state file, so an interrupted run picks up where it stopped when started again.
+
+DEFAULT_STATE = 'warm_cache_state.jsonl'
+
+def read_list(path):
+    with open(path) as f:
+        return [line.split('#')[0].strip() for line in f if line.split('#')[0].strip()]
+
+def split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+def build_tasks(cities, cuisines, plans=False, durations=(2,)):
+    # Searches of every city first, then the plans that reuse them
+    tasks = []
+    for city in cities:
+        tasks.append({'kind': 'transit', 'city': city})
+        tasks.append({'kind': 'tourist', 'city': city})
+        for cuisine in cuisines:
+            tasks.append({'kind': 'restaurant', 'city': city, 'cuisine': cuisine})
+    if plans:
+        for city in cities:
+            for cuisine in cuisines:
+                for duration in durations:
+                    tasks.append({'kind': 'plan', 'city': city, 'cuisine': cuisine, 'duration': duration})
+    return tasks
+
+def task_id(task):
+    return json.dumps(task, sort_keys=True)
+
+def load_done(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+def run_task(data_loader, task):
+    if task['kind'] == 'transit':
+        return len(data_loader.get_transit(task['city']))
+    if task['kind'] == 'tourist':
+        return len(data_loader.get_tourist('', task['city']))
+    if task['kind'] == 'restaurant':
+        return len(data_loader.get_restaurants(task['cuisine'], task['city']))
+    params = {'location': task['city'], 'cuisine': task['cuisine'], 'duration': task['duration']}
+    for stage, payload in data_loader.iter_apply_filters(params):
+        if stage == 'itinerary':
+            return len(payload['places'])
+
+def warm(data_loader, tasks, state_path=DEFAULT_STATE, concurrency=4, rate=2.0):
+    # Runs the tasks not in the state file yet, at most concurrency at once and rate per second
+    done = load_done(state_path)
+    pending = [task for task in tasks if task_id(task) not in done]
+    print('Warming {} tasks, {} already done'.format(len(pending), len(tasks) - len(pending)))
+    bucket = TokenBucket(rate) if rate else None
+    lock = threading.Lock()
+    report = {'done': 0, 'failed': 0, 'skipped': len(tasks) - len(pending)}
+    def run(task):
+        if bucket is not None:
+            bucket.acquire()
+        tic = time.time()
+        size = run_task(data_loader, task)
+        return size, time.time() - tic
+
+    with open(state_path, 'a') as state, concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(run, task): task for task in pending}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                task = futures[future]
+                try:
+                    size, seconds = future.result()
+                except Exception as e:
+                    report['failed'] += 1
+                    print('FAILED {}: {}'.format(task_id(task), e))
+                    continue
+                with lock:
+                    state.write(task_id(task) + '\n')
+                    state.flush()
+                report['done'] += 1
+                print('{} {} results in {}s'.format(task_id(task), size, round(seconds, 2)))
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            print('Interrupted, run again to resume')
+            raise
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warm the Maps and plan caches for a list of cities')
+    parser.add_argument('cities', help='file with one city per line')
+    parser.add_argument('--cuisines', default='', help='comma separated cuisines')
+    parser.add_argument('--cuisines-file', help='file with one cuisine per line')
+    parser.add_argument('--plans', action='store_true', help='also store plans in LLMCache')
+    parser.add_argument('--durations', default='2', help='comma separated trip durations for --plans')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=2.0, help='tasks started per second, 0 for no limit')
+    parser.add_argument('--state', default=DEFAULT_STATE, help='file of finished tasks used to resume')
+    parser.add_argument('--maps-base-url', help='local Maps stand-in, e.g. http://localhost:8081')
+    args = parser.parse_args()
+
+    secrets = load_secrets()
+    setup_logging(secrets['LOG_PROFILE'])
+    cuisines = split_list(args.cuisines) + (read_list(args.cuisines_file) if args.cuisines_file else [])
+    data_loader = DataLoader(maps_api_key=secrets['GOOGLE_MAPS_API_KEY'],
+                             mongo_connection_string=secrets['MONGO_CONNECTION_STRING'],
+                             gemini_api_key=secrets['GOOGLE_GEMINI_API_KEY'],
+                             maps_base_url=args.maps_base_url or secrets['MAPS_BASE_URL'],
+                             gemini_base_url=secrets['GEMINI_BASE_URL'])
+    tasks = build_tasks(read_list(args.cities), cuisines, args.plans, [int(d) for d in split_list(args.durations)])
+    print(warm(data_loader, tasks, args.state, args.concurrency, args.rate))
+    print('Maps client:', data_loader.maps.stats())